@@ -9,4 +9,21 @@ class Settings:
     BINANCE_API_BASE: str = os.getenv("BINANCE_API_BASE")
     BINANCE_API_KEY: str = os.getenv("BINANCE_API_KEY")
 
+    MONGO_URI: str = os.getenv("MONGO_URI")
+    MONGO_MAX_POOL_SIZE: int = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+    MONGO_MIN_POOL_SIZE: int = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+    MONGO_MAX_IDLE_TIME_MS: int = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+
+    # Import pandas / pandas_ta in the background after startup so the first
+    # backtest doesn't pay for it. Disable on very small instances.
+    PRELOAD_ENGINE: bool = os.getenv("PRELOAD_ENGINE", "true").lower() == "true"
+
 settings = Settings()
+
+# Every backtest (single, portfolio, Monte Carlo) starts from this balance
+STARTING_EQUITY = 10000.0
+
+# Upper bound on Monte Carlo simulations x trades: the resampled matrix and the
+# equity paths built from it are float64 arrays of this size (~40 MB each)
+MAX_SIMULATED_TRADES = 5_000_000
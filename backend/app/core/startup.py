@@ -0,0 +1,40 @@
+# File: app/core/startup.py
+
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+# Taken when app.main first imports this module - close enough to process start
+PROCESS_START = time.perf_counter()
+
+
+class StartupProfile:
+    """Records how long each startup phase took and when the app became ready."""
+
+    def __init__(self):
+        self.phases: List[Tuple[str, float]] = []
+        self.ready_ms: Optional[float] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, (time.perf_counter() - started) * 1000))
+
+    def mark_ready(self):
+        self.ready_ms = (time.perf_counter() - PROCESS_START) * 1000
+        print("🚀 Startup profile:")
+        for name, ms in self.phases:
+            print(f"   {name:<24} {ms:8.1f} ms")
+        print(f"   {'ready after':<24} {self.ready_ms:8.1f} ms")
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "ready_ms": round(self.ready_ms, 1) if self.ready_ms is not None else None,
+            "phases": {name: round(ms, 1) for name, ms in self.phases},
+        }
+
+
+startup_profile = StartupProfile()
@@ -1,9 +1,52 @@
+from typing import Optional
+
 from pymongo import MongoClient
-import os
-from dotenv import load_dotenv
+from pymongo.collection import Collection
+from pymongo.errors import PyMongoError
+
+from app.core.config import settings
+
+DB_NAME = "cryptoTrack_db"
+
+client: Optional[MongoClient] = None
+
+
+def connect() -> MongoClient:
+    """
+    Create the shared MongoClient. Called from the app lifespan rather than at
+    import time; connect=False defers the first server round-trip to the first
+    query so startup doesn't wait on the network.
+    """
+    global client
+    if client is None:
+        client = MongoClient(
+            settings.MONGO_URI,
+            maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+            minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=settings.MONGO_MAX_IDLE_TIME_MS,
+            serverSelectionTimeoutMS=settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            connect=False,
+        )
+    return client
+
+
+def close():
+    global client
+    if client is not None:
+        client.close()
+        client = None
+
+
+def get_users_collection() -> Collection:
+    return connect()[DB_NAME]["users"]
 
-load_dotenv()
 
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["cryptoTrack_db"]
-users_collection = db["users"]
+def ensure_indexes():
+    """
+    Idempotent index setup, run once per replica in the background at startup.
+    The unique index on `sub` backs the login upsert.
+    """
+    try:
+        get_users_collection().create_index("sub", unique=True, name="sub_unique")
+    except PyMongoError as exc:
+        print("⚠️ Could not create Mongo indexes:", exc)
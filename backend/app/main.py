@@ -1,11 +1,41 @@
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from app.routes import auth
-from app.core.config import settings
-from app.routes import auth, binance_test, strategy
-from app.routes import backtest
+from app.core.startup import startup_profile
 
-app = FastAPI()
+import threading
+from contextlib import asynccontextmanager
+
+with startup_profile.phase("import fastapi"):
+    from fastapi import FastAPI
+    from fastapi.middleware.cors import CORSMiddleware
+
+with startup_profile.phase("import routers"):
+    from app.core.config import settings
+    from app.db import db
+    from app.routes import auth, backtest, binance_test, strategy
+
+
+def preload_engine():
+    """Import the pandas / indicator stack off the request path."""
+    with startup_profile.phase("preload engine (bg)"):
+        import app.services.portfolio_engine  # noqa: F401  (imports backtest_engine too)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with startup_profile.phase("mongo client"):
+        db.connect()
+
+    # Index creation needs a server round-trip; don't block readiness on it
+    threading.Thread(target=db.ensure_indexes, name="mongo-indexes", daemon=True).start()
+
+    if settings.PRELOAD_ENGINE:
+        threading.Thread(target=preload_engine, name="preload-engine", daemon=True).start()
+
+    startup_profile.mark_ready()
+    yield
+    db.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:3000",
@@ -32,3 +62,9 @@ app.include_router(backtest.router, prefix="/api")
 @app.get("/")
 def read_root():
     return {"status": "ok", "message": "Phoenix Backend is running 🚀"}
+
+
+@app.get("/startup")
+def startup_report():
+    """Startup-time profile of this replica (phase durations in ms)."""
+    return startup_profile.report()
@@ -1,9 +1,18 @@
-from fastapi import APIRouter, HTTPException
+import threading
+import time
+from typing import Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel
-from google.oauth2 import id_token
-from google.auth.transport import requests
-from app.core.config import settings
-from app.db.db import users_collection  
+from app.db.db import get_users_collection
+
+USER_PROJECTION = {"_id": 1, "sub": 1, "name": 1, "email": 1, "picture": 1}
+USER_COUNT_TTL_SECONDS = 60
+
+user_count_cache = {"value": 0, "expires": 0.0}
+user_count_lock = threading.Lock()
 
 router = APIRouter()
 
@@ -13,15 +22,14 @@ class TokenRequest(BaseModel):
 @router.post("/auth/google")
 def verify_google_token(request: TokenRequest):
     """Verify Google ID token and store user in MongoDB"""
+    # google-auth is slow to import; only pay for it on the first login
+    from app.services.google_auth_service import verify_google_id_token
+
     try:
         token = request.token
 
-        # Verify token using Google's public keys
-        id_info = id_token.verify_oauth2_token(
-            token,
-            requests.Request(),
-            settings.GOOGLE_CLIENT_ID
-        )
+        # Verify token using Google's public keys (certs + verified tokens are cached)
+        id_info, cached = verify_google_id_token(token)
 
         # Extract user info
         user_data = {
@@ -31,13 +39,15 @@ def verify_google_token(request: TokenRequest):
             "picture": id_info.get("picture"),
         }
 
-        # Upsert (insert if new, update if exists)
-        users_collection.update_one(
-            {"sub": user_data["sub"]},
-            {"$set": user_data},
-            upsert=True
-        )
-        print("Authenticated User: ",id_info.get("name")," ",id_info.get("email"))
+        # Upsert (insert if new, update if exists) - skipped when this exact
+        # token was already verified, since the profile can't have changed
+        if not cached:
+            get_users_collection().update_one(
+                {"sub": user_data["sub"]},
+                {"$set": user_data},
+                upsert=True
+            )
+            print("Authenticated User: ",id_info.get("name")," ",id_info.get("email"))
         return {"status": "success", "user": user_data}
 
     except Exception as e:
@@ -45,8 +55,43 @@ def verify_google_token(request: TokenRequest):
         raise HTTPException(status_code=401, detail="Invalid Google token")
 
 
+def count_users() -> int:
+    """Approximate user count from collection metadata, cached briefly."""
+    now = time.monotonic()
+    with user_count_lock:
+        if user_count_cache["expires"] > now:
+            return user_count_cache["value"]
+
+    value = get_users_collection().estimated_document_count()
+    with user_count_lock:
+        user_count_cache.update(value=value, expires=now + USER_COUNT_TTL_SECONDS)
+    return value
+
+
 @router.get("/users")
-def get_all_users():
-    """Fetch all users and total count"""
-    users = list(users_collection.find({}, {"_id": 0}))
-    return {"count": len(users), "users": users}
+def get_all_users(
+    limit: int = Query(100, ge=1, le=500, description="Page size"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+):
+    """Fetch one page of users (ordered by _id) plus the total count"""
+    query = {}
+    if cursor:
+        try:
+            query["_id"] = {"$gt": ObjectId(cursor)}
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    # One extra document tells us whether there's a next page
+    docs = list(
+        get_users_collection()
+        .find(query, USER_PROJECTION)
+        .sort("_id", 1)
+        .limit(limit + 1)
+    )
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+
+    next_cursor = str(docs[-1]["_id"]) if has_more else None
+    users = [{k: v for k, v in doc.items() if k != "_id"} for doc in docs]
+
+    return {"count": count_users(), "users": users, "next_cursor": next_cursor}
@@ -1,50 +1,86 @@
 # File: app/routes/backtest.py
 
+from typing import Annotated, Any, Dict, List, Literal, Optional, Tuple, Union
+
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, ValidationError, model_validator
+
+from app.core.config import MAX_SIMULATED_TRADES
+from app.services.binance_service import BinanceRateLimited
+from app.services.gemini_service import (
+    StrategyRules,
+    validate_strategies_with_gemini,
+    validate_strategy_with_gemini,
+)
+from app.utils.responses import FastJSONResponse
 
-from app.services.backtest_engine import run_backtest
-from app.services.gemini_service import validate_strategy_with_gemini
+# The engines pull in pandas / pandas_ta, so they're imported inside the
+# handlers (or preloaded in the background from the app lifespan).
 
 router = APIRouter()
 
 
+class RobustnessOptions(BaseModel):
+    method: Literal["bootstrap", "shuffle"] = "bootstrap"
+    simulations: int = Field(10_000, ge=100, le=50_000)
+    seed: Optional[int] = None       # set for reproducible intervals
+    confidence: float = Field(0.95, gt=0, lt=1)
+
+
 class BacktestRequest(BaseModel):
     asset: str
     strategy: str
     timeframe: str   # e.g. "1m", "5m", "1h", "1d"
     range: str       # e.g. "7d", "30d", "6m", "1y"
+    robustness: Optional[RobustnessOptions] = None   # add Monte Carlo analysis of the trades
 
 
-@router.post("/backtest")
-def backtest(req: BacktestRequest):
+class RobustnessRequest(RobustnessOptions):
+    # pl_pct of each trade; a trade can lose at most 100%
+    trade_returns: List[Annotated[float, Field(gt=-1)]] = Field(..., min_length=1, max_length=5_000)
+
+    @model_validator(mode="after")
+    def check_size(self):
+        if self.simulations * len(self.trade_returns) > MAX_SIMULATED_TRADES:
+            raise ValueError(f"simulations x len(trade_returns) must be at most {MAX_SIMULATED_TRADES:,}")
+        return self
+
+
+class PortfolioBacktestRequest(BaseModel):
+    assets: List[str] = Field(..., min_length=1, max_length=20)   # e.g. ["BTC", "ETH", "SOL"]
+    strategy: str
+    timeframe: str
+    range: str
+    max_positions: Optional[int] = Field(None, ge=1)     # default: one slot per asset
+    rebalance_every: Optional[int] = Field(None, ge=1)   # bars between rebalances
+
+
+class CompareBacktestRequest(BaseModel):
+    asset: str
+    timeframe: str
+    range: str
+    # Each item is strategy text (interpreted by Gemini) or a ready rules object
+    strategies: List[Union[str, Dict[str, Any]]] = Field(..., min_length=1, max_length=10)
+
+
+def rules_from_response(ai_response: Optional[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
     """
-    1. Validate & interpret strategy using Gemini
-    2. Ensure rules object is clean (buy/sell always exist)
-    3. Run the backtest engine
-    4. Return performance metrics + rules + trade log + equity curve
+    Turn a Gemini validation response into engine rules.
+    Returns (rules, None) when valid or (None, invalid_strategy_response) when not.
     """
 
-    # ---------------------------
-    # 1. Validate strategy using Gemini
-    # ---------------------------
-    ai_response = validate_strategy_with_gemini(req.strategy)
-
     if not ai_response:
         raise HTTPException(status_code=500, detail="Gemini validation failed.")
 
     # If Gemini says strategy is invalid
     if ai_response.get("valid") is False:
-        return {
+        return None, {
             "status": "invalid_strategy",
             "error": ai_response.get("error"),
             "suggestions": ai_response.get("suggestions", []),
             "rules": ai_response.get("rules", {"buy": {}, "sell": {}}),
         }
 
-    # ---------------------------
-    # 2. SAFE rule extraction
-    # ---------------------------
     rules = ai_response.get("rules", {})
 
     # If somehow Gemini returned a list → reject safely
@@ -57,26 +93,277 @@ def backtest(req: BacktestRequest):
     # Ensure essential keys exist
     rules.setdefault("buy", {})
     rules.setdefault("sell", {})
+    return rules, None
 
-    # ---------------------------
-    # 3. Run Backtest Engine
-    # ---------------------------
+
+def interpret_strategy(strategy: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Validate & interpret a strategy with Gemini (see `rules_from_response`)."""
+    return rules_from_response(validate_strategy_with_gemini(strategy))
+
+
+def run_engine(engine, **kwargs) -> Dict[str, Any]:
+    """Run a backtest engine and map its failures to HTTP errors."""
     try:
-        result = run_backtest(
-            asset=req.asset,
-            interval=req.timeframe,
-            range_value=req.range,
-            rules=rules
+        return engine(**kwargs)
+    except BinanceRateLimited as exc:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Market data temporarily unavailable: {exc}",
+            headers={"Retry-After": str(int(exc.retry_after) + 1)},
         )
+    except ValueError as exc:
+        # Bad range / timeframe / not enough history for the requested indicators
+        raise HTTPException(status_code=400, detail=str(exc))
     except Exception as exc:
         print("BACKTEST ENGINE ERROR:", exc)
         raise HTTPException(status_code=500, detail=f"Backtest failed: {str(exc)}")
 
+
+def robustness_report(trades: List[Dict[str, Any]], options: RobustnessOptions) -> Optional[Dict[str, Any]]:
+    """
+    Monte Carlo intervals for a finished run; None when there are no trades.
+    Simulations are reduced when needed to stay under MAX_SIMULATED_TRADES
+    (the report's "simulations" field shows the count actually run).
+    """
+    from app.services.robustness import monte_carlo
+
+    if not trades:
+        return None
+    return monte_carlo(
+        [t["pl_pct"] for t in trades],
+        simulations=min(options.simulations, MAX_SIMULATED_TRADES // len(trades)),
+        method=options.method,
+        seed=options.seed,
+        confidence=options.confidence,
+    )
+
+
+@router.post("/backtest", response_class=FastJSONResponse)
+def backtest(req: BacktestRequest):
+    """
+    1. Validate & interpret strategy using Gemini
+    2. Ensure rules object is clean (buy/sell always exist)
+    3. Run the backtest engine (+ optional Monte Carlo robustness analysis)
+    4. Return performance metrics + rules + trade log + equity curve
+    """
+    from app.services.backtest_engine import run_backtest
+
+    # ---------------------------
+    # 1-2. Validate strategy using Gemini + SAFE rule extraction
+    # ---------------------------
+    rules, invalid = interpret_strategy(req.strategy)
+    if invalid:
+        return invalid
+
+    # ---------------------------
+    # 3. Run Backtest Engine
+    # ---------------------------
+    result = run_engine(
+        run_backtest,
+        asset=req.asset,
+        interval=req.timeframe,
+        range_value=req.range,
+        rules=rules,
+    )
+
+    if req.robustness:
+        result["robustness"] = robustness_report(result["trades"], req.robustness)
+
     # ---------------------------
     # 4. Return full backtest data
     # ---------------------------
-    return {
+    # Returned as a Response so the equity curve array goes straight to orjson
+    return FastJSONResponse({
         "status": "success",
         "rules": rules,
         "result": result,
+    })
+
+
+@router.post("/backtest/portfolio", response_class=FastJSONResponse)
+def backtest_portfolio(req: PortfolioBacktestRequest):
+    """
+    Run one rule set over a basket of assets sharing a single capital pool.
+    Returns portfolio metrics + equity curve + per-asset attribution + trade log.
+    """
+    from app.services.portfolio_engine import run_portfolio_backtest
+
+    rules, invalid = interpret_strategy(req.strategy)
+    if invalid:
+        return invalid
+
+    result = run_engine(
+        run_portfolio_backtest,
+        assets=req.assets,
+        interval=req.timeframe,
+        range_value=req.range,
+        rules=rules,
+        max_positions=req.max_positions,
+        rebalance_every=req.rebalance_every,
+    )
+
+    return FastJSONResponse({
+        "status": "success",
+        "rules": rules,
+        "result": result,
+    })
+
+
+def compare_rule_problems(
+    rules: Dict[str, Any],
+    interval: str,
+    range_value: str,
+) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """
+    Check one compare entry's rules against the typed rules model, the base
+    interval and the history cap before anything runs, so a bad entry can't
+    fail the whole batch.
+    Returns (normalized rules, []) when runnable or (None, problems) when not.
+    """
+    from app.services.timeframes import check_history, required_timeframes, validate_higher_timeframe
+
+    try:
+        parsed = StrategyRules.model_validate(rules)
+    except ValidationError as exc:
+        return None, [
+            f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}"
+            for err in exc.errors()
+        ]
+
+    problems = parsed.buy.problems("buy") + parsed.sell.problems("sell")
+    if problems:
+        return None, problems
+
+    normalized = {
+        "buy": parsed.buy.model_dump(exclude_none=True),
+        "sell": parsed.sell.model_dump(exclude_none=True),
     }
+    timeframes = required_timeframes([normalized])
+    for timeframe in sorted(timeframes):
+        if timeframe == interval:
+            continue
+        try:
+            validate_higher_timeframe(interval, timeframe)
+        except ValueError as exc:
+            problems.append(str(exc))
+
+    if timeframes and not problems:
+        try:
+            check_history(interval, range_value, timeframes)
+        except ValueError as exc:
+            problems.append(str(exc))
+
+    return (None, problems) if problems else (normalized, [])
+
+
+def interpret_compare_item(
+    item: Union[str, Dict[str, Any]],
+    ai_response: Optional[Dict[str, Any]],
+    interval: str,
+    range_value: str,
+) -> Dict[str, Any]:
+    """
+    Turn one /backtest/compare entry into {"rules": ...} when runnable, or an
+    entry with a non-success "status" (invalid_strategy / error) when not.
+    `ai_response` is Gemini's answer for text entries (unused for rules objects).
+    """
+    if isinstance(item, dict):
+        rules = item.get("rules", item)
+        if not isinstance(rules, dict) or not all(isinstance(rules.get(k), dict) for k in ("buy", "sell")):
+            return {"status": "invalid_strategy", "error": "Rules must contain buy and sell objects."}
+    else:
+        try:
+            rules, invalid = rules_from_response(ai_response)
+        except HTTPException as exc:
+            return {"status": "error", "error": exc.detail}
+        if invalid:
+            return invalid
+
+    normalized, problems = compare_rule_problems(rules, interval, range_value)
+    if problems:
+        return {"status": "invalid_strategy", "error": "; ".join(problems), "rules": rules}
+    return {"rules": normalized}
+
+
+@router.post("/backtest/compare", response_class=FastJSONResponse)
+def backtest_compare(req: CompareBacktestRequest):
+    """
+    Compare several strategies on the same asset / timeframe / range.
+    1. Interpret all strategy texts with a single batched Gemini call
+    2. Load candles + indicators once and evaluate every strategy in one batch
+    3. Return side-by-side metrics + each strategy's full result
+    """
+    from app.services.backtest_engine import run_backtest_batch
+
+    # ---------------------------
+    # 1. Interpret strategies (one model call for all texts)
+    # ---------------------------
+    texts = [item for item in req.strategies if isinstance(item, str)]
+    answers = iter(validate_strategies_with_gemini(texts))
+    interpreted = [
+        interpret_compare_item(item, next(answers) if isinstance(item, str) else None, req.timeframe, req.range)
+        for item in req.strategies
+    ]
+
+    runnable = [i for i, item in enumerate(interpreted) if "status" not in item]
+
+    # ---------------------------
+    # 2. One dataset, one batched pass
+    # ---------------------------
+    results = []
+    if runnable:
+        results = run_engine(
+            run_backtest_batch,
+            asset=req.asset,
+            interval=req.timeframe,
+            range_value=req.range,
+            rule_sets=[interpreted[i]["rules"] for i in runnable],
+        )
+
+    for i, result in zip(runnable, results):
+        if "error" in result:
+            interpreted[i].update(status="invalid_strategy", error=result["error"])
+        else:
+            interpreted[i].update(status="success", result=result)
+    ran = [i for i in runnable if interpreted[i]["status"] == "success"]
+
+    # ---------------------------
+    # 3. Side-by-side summary
+    # ---------------------------
+    comparison = [
+        {
+            "index": i,
+            "final_equity": interpreted[i]["result"]["final_equity"],
+            "win_ratio": interpreted[i]["result"]["win_ratio"],
+            "profit_factor": interpreted[i]["result"]["profit_factor"],
+            "total_trades": interpreted[i]["result"]["total_trades"],
+        }
+        for i in ran
+    ]
+
+    return FastJSONResponse({
+        "status": "success",
+        "comparison": comparison,
+        "strategies": [
+            {"index": i, "input": req.strategies[i], **item}
+            for i, item in enumerate(interpreted)
+        ],
+    })
+
+
+@router.post("/backtest/robustness", response_class=FastJSONResponse)
+def backtest_robustness(req: RobustnessRequest):
+    """
+    Robustness analysis of an existing run's trade returns (result.trades[*].pl_pct)
+    without re-running the backtest. Returns confidence intervals for final
+    equity, max drawdown and win ratio.
+    """
+    from app.services.robustness import monte_carlo
+
+    return FastJSONResponse(monte_carlo(
+        req.trade_returns,
+        simulations=req.simulations,
+        method=req.method,
+        seed=req.seed,
+        confidence=req.confidence,
+    ))
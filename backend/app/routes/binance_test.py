@@ -1,11 +1,12 @@
 # File: app/routes/binance_test.py
 
 from fastapi import APIRouter, HTTPException, Query
-from app.services.binance_service import get_klines
+from app.services.binance_service import BinanceRateLimited, get_klines
+from app.utils.responses import FastJSONResponse
 
 router = APIRouter()
 
-@router.get("/binance/test")
+@router.get("/binance/test", response_class=FastJSONResponse)
 def test_binance_data(
     asset: str = Query(..., description="Asset symbol, e.g. BTC, ETH"),
     interval: str = Query(..., description="Timeframe: 1m, 5m, 15m, 1h, 4h, 1d"),
@@ -19,11 +20,18 @@ def test_binance_data(
 
     try:
         candles = get_klines(asset, interval, range_value)
-        return {
+        return FastJSONResponse({
             "status": "success",
             "count": len(candles),
             "sample": candles[:5],   # return first 5 candles only
-        }
+        })
+
+    except BinanceRateLimited as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(int(e.retry_after) + 1)},
+        )
 
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -1,15 +1,25 @@
 # File: app/services/backtest_engine.py
 
+import numpy as np
 import pandas as pd
 import pandas_ta as ta
-from typing import Dict, Any, List
-from app.services.binance_service import get_klines
+from typing import Dict, Any, List, Optional, Set
+from app.core.config import STARTING_EQUITY
+from app.services.binance_service import calculate_limit, get_klines
+from app.services.timeframes import (
+    align_higher_timeframe,
+    required_timeframes,
+    resample_candles,
+    check_history,
+    validate_higher_timeframe,
+    warmup_bars,
+)
 
 # -----------------------------
 # LOAD PRICE DATA + INDICATORS
 # -----------------------------
-def load_price_data(asset: str, interval: str, range_value: str) -> pd.DataFrame:
-    candles = get_klines(asset, interval, range_value)
+def load_price_data(asset: str, interval: str, range_value: str, warmup: int = 0) -> pd.DataFrame:
+    candles = get_klines(asset, interval, range_value, warmup)
     df = pd.DataFrame(candles)
 
     df["timestamp"] = pd.to_datetime(df["timestamp"], unit="ms")
@@ -20,7 +30,7 @@ def load_price_data(asset: str, interval: str, range_value: str) -> pd.DataFrame
     return df
 
 
-def apply_indicators(df: pd.DataFrame) -> pd.DataFrame:
+def apply_indicators(df: pd.DataFrame, dropna: bool = True) -> pd.DataFrame:
     # RSI
     df["rsi"] = ta.rsi(df["close"], length=14)
 
@@ -41,221 +51,357 @@ def apply_indicators(df: pd.DataFrame) -> pd.DataFrame:
         df["signal"] = macd["MACDs_12_26_9"]
         df["histogram"] = macd["MACDh_12_26_9"]
 
-    df.dropna(inplace=True)
-    df.reset_index(drop=True, inplace=True)
+    if dropna:
+        df.dropna(inplace=True)
+        df.reset_index(drop=True, inplace=True)
+    return df
+
+
+def add_higher_timeframes(
+    df: pd.DataFrame,
+    candles: pd.DataFrame,
+    interval: str,
+    timeframes: Set[str],
+) -> pd.DataFrame:
+    """
+    Attach "<column>_<timeframe>" indicator columns for every requested higher
+    timeframe (see `required_timeframes`). Each timeframe is resampled from the
+    base candles (no extra Binance calls) and its indicators are computed once.
+    """
+    for timeframe in sorted(timeframes):
+        if timeframe == interval:
+            # Same as base: just alias the existing columns
+            base_cols = [c for c in df.columns if c != "timestamp"]
+            df = df.join(df[base_cols].add_suffix(f"_{timeframe}"))
+            continue
+
+        validate_higher_timeframe(interval, timeframe)
+
+        higher = resample_candles(candles, interval, timeframe)
+        higher = apply_indicators(higher, dropna=False)
+        # pandas_ta returns None when there's not enough history (e.g. EMA200 on 40 daily bars)
+        indicator_cols = [c for c in higher.columns if c != "timestamp"]
+        higher[indicator_cols] = higher[indicator_cols].astype(float)
+
+        df = align_higher_timeframe(df, higher, interval, timeframe)
+
     return df
 
 
 # -----------------------------
-# UNIVERSAL RULE CHECKER
+# VECTORIZED RULE EVALUATION
 # -----------------------------
-def check_condition(df: pd.DataFrame, i: int, rule: Dict[str, Any]) -> bool:
+EMA_INDICATORS = ["EMA20", "EMA50", "EMA100", "EMA200"]
+
+
+def frame_arrays(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Column name -> float array, the input format of `signal_mask`."""
+    return {c: df[c].to_numpy(dtype=float) for c in df.columns if c != "timestamp"}
+
+
+def _prev(a: np.ndarray) -> np.ndarray:
+    """Value of the previous bar (NaN on the first bar)."""
+    out = np.full(a.shape, np.nan)
+    out[1:] = a[:-1]
+    return out
+
+
+def _crosses_above(a, b) -> np.ndarray:
+    return (_prev(a) < _prev(b)) & (a > b)
+
+
+def _crosses_below(a, b) -> np.ndarray:
+    return (_prev(a) > _prev(b)) & (a < b)
+
+
+def signal_mask(data: Dict[str, np.ndarray], rule: Dict[str, Any]) -> np.ndarray:
+    """
+    Evaluate a rule on every bar at once.
+
+    `data` maps column names to arrays with time on axis 0. Arrays may be 1-D
+    (one asset) or 2-D (time x assets), in which case every asset is evaluated
+    in the same pass. Returns a boolean array of the same shape; the first bar
+    is always False since crossovers need a previous bar.
+    """
+    shape = data["close"].shape
+    mask = _rule_mask(data, rule, shape)
+    mask[:1] = False
+    return mask
+
+
+def _column(data: Dict[str, np.ndarray], name: str, timeframe: Optional[str]) -> Optional[np.ndarray]:
     """
-    Universal condition checker that handles ALL indicator types and conditions.
-    Works for both buy and sell rules.
+    Look up an indicator column ("ema200" + "_1d"). A higher-timeframe column
+    that is NaN on every bar means the history was too short for it, which
+    would otherwise silently produce no trades.
     """
-    if not rule or i < 1:
-        return False
+    column = f"{name}_{timeframe}" if timeframe else name
+    values = data.get(column)
+    if timeframe and values is not None and np.isnan(values).all():
+        raise ValueError(
+            f"Not enough {timeframe} history to compute {column}. "
+            f"Use a shorter indicator or a larger base timeframe."
+        )
+    return values
+
+
+def _rule_mask(data: Dict[str, np.ndarray], rule: Dict[str, Any], shape) -> np.ndarray:
+    none = np.zeros(shape, dtype=bool)
+    if not rule:
+        return none
+
+    # Composite rule: every sub-condition must hold
+    if "all" in rule:
+        conditions = rule.get("all") or []
+        if not conditions:
+            return none
+        mask = np.ones(shape, dtype=bool)
+        for sub in conditions:
+            mask &= _rule_mask(data, sub, shape)
+        return mask
+
+    timeframe = rule.get("timeframe")
+    close = _column(data, "close", timeframe)
+    if close is None:
+        return none
 
     indicator = rule.get("indicator", "").upper()
     condition = rule.get("condition", rule.get("operator", ""))
     value = rule.get("value")
-    compare_to = rule.get("compare_to", "").upper()
 
-    # -----------------------------
-    # RSI CONDITIONS
-    # -----------------------------
+    # RSI
     if indicator == "RSI":
-        rsi = df.loc[i, "rsi"]
-        
-        if condition == "<" or condition == "less_than" or condition == "below":
+        rsi = _column(data, "rsi", timeframe)
+        if rsi is None or value is None:
+            return none
+        if condition in ("<", "less_than", "below"):
             return rsi < value
-        if condition == ">" or condition == "greater_than" or condition == "above":
+        if condition in (">", "greater_than", "above"):
             return rsi > value
         if condition == "crosses_above":
-            prev_rsi = df.loc[i - 1, "rsi"]
-            return prev_rsi < value and rsi > value
+            return (_prev(rsi) < value) & (rsi > value)
         if condition == "crosses_below":
-            prev_rsi = df.loc[i - 1, "rsi"]
-            return prev_rsi > value and rsi < value
-
-    # -----------------------------
-    # EMA CONDITIONS
-    # -----------------------------
-    if indicator in ["EMA20", "EMA50", "EMA100", "EMA200"]:
-        ema_col = indicator.lower()
-        if ema_col not in df.columns:
-            return False
-            
-        close = df.loc[i, "close"]
-        ema = df.loc[i, ema_col]
-        
-        # Price vs EMA
-        if condition == "<" or condition == "below":
-            return close < ema
-        if condition == ">" or condition == "above":
-            return close > ema
-        
-        # Price crosses EMA
+            return (_prev(rsi) > value) & (rsi < value)
+        return none
+
+    # EMA: price vs EMA, or EMA vs EMA when compare_to names the slower one
+    if indicator in EMA_INDICATORS:
+        ema = _column(data, indicator.lower(), timeframe)
+        compare_to = rule.get("compare_to")
+        if compare_to:
+            line, ema = ema, _column(data, compare_to.lower(), timeframe)
+        else:
+            line = close
+        if ema is None or line is None:
+            return none
+        if condition in ("<", "below"):
+            return line < ema
+        if condition in (">", "above"):
+            return line > ema
         if condition == "crosses_above":
-            prev_close = df.loc[i - 1, "close"]
-            prev_ema = df.loc[i - 1, ema_col]
-            return prev_close < prev_ema and close > ema
+            return _crosses_above(line, ema)
         if condition == "crosses_below":
-            prev_close = df.loc[i - 1, "close"]
-            prev_ema = df.loc[i - 1, ema_col]
-            return prev_close > prev_ema and close < ema
-        
-        # EMA vs EMA crossover
-        if compare_to and compare_to in ["EMA20", "EMA50", "EMA100", "EMA200"]:
-            compare_col = compare_to.lower()
-            if compare_col not in df.columns:
-                return False
-                
-            ema2 = df.loc[i, compare_col]
-            prev_ema = df.loc[i - 1, ema_col]
-            prev_ema2 = df.loc[i - 1, compare_col]
-            
-            if condition == "crosses_above":
-                return prev_ema < prev_ema2 and ema > ema2
-            if condition == "crosses_below":
-                return prev_ema > prev_ema2 and ema < ema2
-
-    # -----------------------------
-    # SMA CONDITIONS (Price crosses SMA)
-    # -----------------------------
+            return _crosses_below(line, ema)
+        return none
+
+    # SMA (price crosses SMA)
     if indicator == "PRICE" and rule.get("moving_average"):
-        ma = rule.get("moving_average", {})
-        period = ma.get("period")
-        
-        if not period:
-            return False
-            
-        sma_col = f"sma{period}"
-        if sma_col not in df.columns:
-            return False
-            
-        close = df.loc[i, "close"]
-        sma = df.loc[i, sma_col]
-        prev_close = df.loc[i - 1, "close"]
-        prev_sma = df.loc[i - 1, sma_col]
-        
+        period = rule["moving_average"].get("period")
+        sma = _column(data, f"sma{period}", timeframe) if period else None
+        if sma is None:
+            return none
         if condition == "crosses_above":
-            return prev_close < prev_sma and close > sma
+            return _crosses_above(close, sma)
         if condition == "crosses_below":
-            return prev_close > prev_sma and close < sma
+            return _crosses_below(close, sma)
+        return none
 
-    # -----------------------------
-    # MACD CONDITIONS
-    # -----------------------------
+    # MACD
     if indicator == "MACD":
-        if "macd" not in df.columns or "signal" not in df.columns:
-            return False
-            
-        macd = df.loc[i, "macd"]
-        signal = df.loc[i, "signal"]
-        
-        if condition == ">" or condition == "above":
+        macd = _column(data, "macd", timeframe)
+        signal = _column(data, "signal", timeframe)
+        if macd is None or signal is None:
+            return none
+        if condition in (">", "above"):
             return macd > signal
-        if condition == "<" or condition == "below":
+        if condition in ("<", "below"):
             return macd < signal
         if condition == "crosses_above":
-            prev_macd = df.loc[i - 1, "macd"]
-            prev_signal = df.loc[i - 1, "signal"]
-            return prev_macd < prev_signal and macd > signal
+            return _crosses_above(macd, signal)
         if condition == "crosses_below":
-            prev_macd = df.loc[i - 1, "macd"]
-            prev_signal = df.loc[i - 1, "signal"]
-            return prev_macd > prev_signal and macd < signal
-
-    return False
+            return _crosses_below(macd, signal)
 
-
-def check_buy(df: pd.DataFrame, i: int, rule: Dict[str, Any]) -> bool:
-    """Buy condition checker - uses universal checker"""
-    return check_condition(df, i, rule)
-
-
-def check_sell(df: pd.DataFrame, i: int, rule: Dict[str, Any]) -> bool:
-    """Sell condition checker - uses universal checker"""
-    return check_condition(df, i, rule)
+    return none
 
 
 # -----------------------------
 # BACKTEST ENGINE
 # -----------------------------
-def run_backtest(asset: str, interval: str, range_value: str, rules: Dict[str, Any]) -> Dict[str, Any]:
-    df = load_price_data(asset, interval, range_value)
-    df = apply_indicators(df)
+def format_timestamps(timestamps: np.ndarray) -> np.ndarray:
+    """Vectorized "%Y-%m-%d %H:%M:%S" formatting of datetime64 values."""
+    if len(timestamps) == 0:
+        return np.array([], dtype=str)
+    iso = np.datetime_as_string(timestamps.astype("datetime64[s]"), unit="s")
+    return np.char.replace(iso, "T", " ")
 
-    in_trade = False
-    entry_price = None
-    entry_index = None
-    trades: List[Dict[str, Any]] = []
 
-    equity = 10000.0
-    equity_curve: List[float] = [equity]
+def build_result(df: pd.DataFrame, entries: List[int], exits: List[int]) -> Dict[str, Any]:
+    """
+    Turn entry/exit bar indices into metrics, trade log and equity curve.
+    Everything is derived from arrays in one pass - no per-trade pandas lookups.
+    """
+    close = df["close"].to_numpy(dtype=float)
+    entry_idx = np.asarray(entries, dtype=np.int64)
+    exit_idx = np.asarray(exits, dtype=np.int64)
+
+    entry_prices = close[entry_idx]
+    exit_prices = close[exit_idx]
+    pl_pct = (exit_prices - entry_prices) / entry_prices
+
+    # Equity only changes on exit bars, so the per-bar curve is a cumprod
+    steps = np.ones(max(len(df), 1))
+    steps[exit_idx] = 1 + pl_pct
+    equity_curve = STARTING_EQUITY * np.cumprod(steps)
+
+    pl_usd = equity_curve[exit_idx - 1] * pl_pct
+    final_equity = float(equity_curve[-1])
+
+    timestamps = df["timestamp"].to_numpy()
+    entry_times = format_timestamps(timestamps[entry_idx]).tolist()
+    exit_times = format_timestamps(timestamps[exit_idx]).tolist()
+
+    trades = [
+        {
+            "entry_time": et,
+            "entry_price": ep,
+            "exit_time": xt,
+            "exit_price": xp,
+            "pl_pct": pp,
+            "pl_usd": pu,
+        }
+        for et, ep, xt, xp, pp, pu in zip(
+            entry_times,
+            entry_prices.tolist(),
+            exit_times,
+            exit_prices.tolist(),
+            np.round(pl_pct, 6).tolist(),
+            np.round(pl_usd, 2).tolist(),
+        )
+    ]
+
+    total = len(pl_pct)
+    rounded = np.round(pl_pct, 6)
+    wins = int((rounded > 0).sum())
+    losses = total - wins
+
+    profit_gains = float(rounded[rounded > 0].sum())
+    profit_losses = float(rounded[rounded <= 0].sum())
 
-    buy_rule = rules.get("buy", {})
-    sell_rule = rules.get("sell", {})
+    profit_factor = (
+        (profit_gains / abs(profit_losses))
+        if profit_losses != 0
+        else (profit_gains if profit_gains != 0 else 1)
+    )
 
-    for i in range(1, len(df)):
-        close_price = float(df.loc[i, "close"])
+    return {
+        "win_ratio": (wins / total) if total else 0,
+        "loss_ratio": (losses / total) if total else 0,
+        "total_trades": total,
+        "profit_factor": round(profit_factor, 3),
+        "equity_curve": equity_curve,
+        "final_equity": round(final_equity, 2),
+        "trades": trades,
+    }
 
-        # BUY
-        if not in_trade and check_buy(df, i, buy_rule):
-            in_trade = True
-            entry_price = close_price
-            entry_index = i
-            equity_curve.append(equity)
-            continue
 
+def find_trades_batch(buy: np.ndarray, sell: np.ndarray):
+    """
+    Entry/exit state machine for S strategies at once.
+
+    `buy` / `sell` are (bars x strategies) masks. Returns one
+    (entry indices, exit indices) pair of closed trades per strategy.
+    A bar that opens a trade is never checked for an exit.
+    """
+    n_strategies = buy.shape[1]
+    in_trade = np.zeros(n_strategies, dtype=bool)
+    entries: List[List[int]] = [[] for _ in range(n_strategies)]
+    exits: List[List[int]] = [[] for _ in range(n_strategies)]
+
+    # Only bars where something can happen matter
+    for i in np.flatnonzero((buy | sell).any(axis=1)).tolist():
+        # BUY
+        entering = ~in_trade & buy[i]
         # SELL
-        if in_trade and check_sell(df, i, sell_rule):
-            exit_price = close_price
-            exit_index = i
+        exiting = in_trade & sell[i]
 
-            pl_pct = (exit_price - entry_price) / entry_price
-            pl_usd = equity * pl_pct
+        for s in np.flatnonzero(entering).tolist():
+            entries[s].append(i)
+        for s in np.flatnonzero(exiting).tolist():
+            exits[s].append(i)
 
-            entry_time = df.loc[entry_index, "timestamp"]
-            exit_time = df.loc[exit_index, "timestamp"]
+        in_trade = (in_trade | entering) & ~exiting
 
-            trade = {
-                "entry_time": entry_time.strftime("%Y-%m-%d %H:%M:%S"),
-                "entry_price": float(entry_price),
-                "exit_time": exit_time.strftime("%Y-%m-%d %H:%M:%S"),
-                "exit_price": float(exit_price),
-                "pl_pct": round(pl_pct, 6),
-                "pl_usd": round(pl_usd, 2),
-            }
-            trades.append(trade)
+    # Open positions at the end are not closed trades
+    return [(e[:len(x)], x) for e, x in zip(entries, exits)]
 
-            equity = equity * (1 + pl_pct)
-            in_trade = False
-            entry_price = None
-            entry_index = None
 
-        equity_curve.append(equity)
+def find_trades(buy: np.ndarray, sell: np.ndarray):
+    """Walk the precomputed signals and return (entry indices, exit indices) of closed trades."""
+    return find_trades_batch(buy[:, None], sell[:, None])[0]
 
-    wins = len([t for t in trades if t["pl_pct"] > 0])
-    losses = len([t for t in trades if t["pl_pct"] <= 0])
 
-    profit_gains = sum([t["pl_pct"] for t in trades if t["pl_pct"] > 0])
-    profit_losses = sum([t["pl_pct"] for t in trades if t["pl_pct"] <= 0])
+def prepare_frame(asset: str, interval: str, range_value: str, timeframes: Set[str]) -> pd.DataFrame:
+    """
+    Candles + base indicators + the higher-timeframe columns the rules need.
+    Higher timeframes get extra base history for their indicator warm-up.
+    Base indicators still only see the requested range, so a strategy's
+    result doesn't depend on what else is in the batch.
+    """
+    check_history(interval, range_value, timeframes)
+    history = load_price_data(asset, interval, range_value, warmup_bars(interval, timeframes))
+    first = max(len(history) - calculate_limit(range_value, interval), 0)
+    candles = history.iloc[first:].reset_index(drop=True)
 
-    profit_factor = (
-        (profit_gains / abs(profit_losses))
-        if profit_losses != 0
-        else (profit_gains if profit_gains != 0 else 1)
-    )
+    df = apply_indicators(candles.copy())
+    return add_higher_timeframes(df, history, interval, timeframes)
 
-    return {
-        "win_ratio": (wins / len(trades)) if trades else 0,
-        "loss_ratio": (losses / len(trades)) if trades else 0,
-        "total_trades": len(trades),
-        "profit_factor": round(profit_factor, 3),
-        "equity_curve": equity_curve,
-        "final_equity": round(equity, 2),
-        "trades": trades,
-    }
\ No newline at end of file
+
+def run_backtest(asset: str, interval: str, range_value: str, rules: Dict[str, Any]) -> Dict[str, Any]:
+    result = run_backtest_batch(asset, interval, range_value, [rules])[0]
+    if "error" in result:
+        raise ValueError(result["error"])
+    return result
+
+
+def run_backtest_batch(
+    asset: str,
+    interval: str,
+    range_value: str,
+    rule_sets: List[Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """
+    Backtest several rule sets on one dataset: candles are loaded and the
+    union of required indicators is computed once, then every strategy's
+    signals go through the state machine together as a (bars x strategies)
+    matrix. Returns one result per rule set, in order.
+    A rule set that can't be evaluated on this data (e.g. a higher-timeframe
+    indicator without enough history) gets {"error": ...} instead of a result.
+    """
+    df = prepare_frame(asset, interval, range_value, required_timeframes(rule_sets))
+
+    data = frame_arrays(df)
+    buy = np.zeros((len(df), len(rule_sets)), dtype=bool)
+    sell = np.zeros_like(buy)
+    errors: Dict[int, str] = {}
+    for s, rules in enumerate(rule_sets):
+        try:
+            buy[:, s] = signal_mask(data, rules.get("buy", {}))
+            sell[:, s] = signal_mask(data, rules.get("sell", {}))
+        except ValueError as exc:
+            # Its all-False columns never trade; the other strategies still run
+            errors[s] = str(exc)
+
+    return [
+        {"error": errors[s]} if s in errors else build_result(df, entries, exits)
+        for s, (entries, exits) in enumerate(find_trades_batch(buy, sell))
+    ]
@@ -1,10 +1,38 @@
 # File: app/services/binance_service.py
 
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
 import requests
-import datetime
+from cachetools import TTLCache
 from app.core.config import settings
 
-BINANCE_BASE = "https://api.binance.com/api/v3/klines"
+BINANCE_BASE = (settings.BINANCE_API_BASE or "https://api.binance.com").rstrip("/")
+KLINES_PATH = "/api/v3/klines"
+
+# Binance REST budget: 6000 request weight per rolling minute per IP
+WEIGHT_LIMIT_PER_MINUTE = 6000
+# Keep some headroom for other processes sharing the IP
+WEIGHT_SAFETY_MARGIN = 0.9
+
+FRESH_TTL_SECONDS = 30       # identical requests inside this window hit the cache
+STALE_TTL_SECONDS = 3600     # how long cached candles may be served during a ban
+DEFAULT_BAN_SECONDS = 60     # used when Binance omits Retry-After
+CACHE_MAX_ENTRIES = 256      # (symbol, interval, limit) combinations kept for stale serving
+
+KLINES_PAGE_SIZE = 1000      # Binance max limit per klines request
+MAX_HISTORY_BARS = 25_000    # cap on paged history (range + indicator warm-up)
+
+INTERVAL_MINUTES = {
+    "1m": 1,
+    "5m": 5,
+    "15m": 15,
+    "1h": 60,
+    "4h": 240,
+    "1d": 1440,
+}
 
 # Convert a range like "30d" or "1y" into number of candles
 def calculate_limit(range_value: str, interval: str):
@@ -25,55 +53,232 @@ def calculate_limit(range_value: str, interval: str):
     else:
         raise ValueError("Invalid range format. Use 7d, 30d, 90d, 6m, 1y, etc.")
 
-    interval_map = {
-        "1m": 1,
-        "5m": 5,
-        "15m": 15,
-        "1h": 60,
-        "4h": 240,
-        "1d": 1440,
-    }
-
-    minutes_per_candle = interval_map.get(interval)
+    minutes_per_candle = INTERVAL_MINUTES.get(interval)
     if minutes_per_candle is None:
         raise ValueError("Invalid interval.")
 
-    return min(total_minutes // minutes_per_candle, 1000)  # Binance max limit=1000
-
+    return min(total_minutes // minutes_per_candle, KLINES_PAGE_SIZE)  # Binance max limit=1000
 
-def get_klines(symbol: str, interval: str, range_value: str):
-    """Fetch historical candles from Binance"""
 
-    limit = calculate_limit(range_value, interval)
+class BinanceRateLimited(Exception):
+    """Raised when Binance has banned/throttled us and no cached data exists."""
 
-    params = {
-        "symbol": f"{symbol}USDT",
-        "interval": interval,
-        "limit": limit,
-    }
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"Binance rate limit active, retry in {retry_after:.0f}s")
 
-    # 🚀 FIX: Add headers so Binance doesn't block (418 Teapot)
-    headers = {
-        "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
-                      "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-        "Accept": "*/*",
-        "X-MBX-APIKEY": settings.BINANCE_API_KEY
-    }
 
-    response = requests.get(BINANCE_BASE, params=params, headers=headers)
-    response.raise_for_status()
+def klines_weight(limit: int) -> int:
+    """Request weight of GET /api/v3/klines for a given limit."""
+    if limit < 100:
+        return 1
+    if limit < 500:
+        return 2
+    if limit <= 1000:
+        return 5
+    return 10
 
-    raw = response.json()
 
-    candles = []
-    for c in raw:
-        candles.append({
+def parse_klines(raw) -> List[Dict[str, float]]:
+    return [
+        {
             "timestamp": c[0],
             "open": float(c[1]),
             "high": float(c[2]),
             "low": float(c[3]),
             "close": float(c[4]),
             "volume": float(c[5]),
+        }
+        for c in raw
+    ]
+
+
+class WeightBucket:
+    """
+    Token bucket over Binance request weight.
+    Refills continuously at the per-minute limit and is re-synced from the
+    X-MBX-USED-WEIGHT-1M header after every response.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_second)
+        self.updated = now
+
+    def acquire(self, weight: int):
+        """Block until `weight` tokens are available, then consume them."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                wait = (weight - self.tokens) / self.refill_per_second
+            time.sleep(wait)
+
+    def sync_used(self, used_weight: int):
+        """Trust the server's view of how much of the minute budget is spent."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, max(self.capacity - used_weight, 0))
+
+
+class BinanceClient:
+    """
+    Shared Binance REST client.
+    - Weight-aware token bucket (never exceeds the per-minute budget)
+    - Coalesces identical in-flight (symbol, interval, limit) requests
+    - Backs off on 429/418 and serves stale cached candles while banned
+    """
+
+    def __init__(self, base_url: str = BINANCE_BASE):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.session.headers.update({
+            # 🚀 FIX: Add headers so Binance doesn't block (418 Teapot)
+            "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+                          "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+            "Accept": "*/*",
         })
+        if settings.BINANCE_API_KEY:
+            self.session.headers["X-MBX-APIKEY"] = settings.BINANCE_API_KEY
+
+        capacity = WEIGHT_LIMIT_PER_MINUTE * WEIGHT_SAFETY_MARGIN
+        self.bucket = WeightBucket(capacity, capacity / 60)
+
+        self.lock = threading.Lock()
+        self.in_flight: Dict[Tuple[str, str, int], Future] = {}
+        # Entries expire after the stale window; the fresh window is checked on read
+        self.cache: TTLCache = TTLCache(maxsize=CACHE_MAX_ENTRIES, ttl=STALE_TTL_SECONDS)
+        self.banned_until = 0.0
+
+    # -----------------------------
+    # PUBLIC
+    # -----------------------------
+    def get_klines(self, symbol: str, interval: str, limit: int) -> List[Dict[str, float]]:
+        key = (symbol, interval, limit)
+
+        with self.lock:
+            cached = self.cache.get(key)
+            now = time.monotonic()
+            if cached and now - cached[0] < FRESH_TTL_SECONDS:
+                return cached[1]
+
+            if now < self.banned_until:
+                return self._stale_or_raise(key, now)
+
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.in_flight[key] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            candles = self._fetch(symbol, interval, limit)
+        except BinanceRateLimited as exc:
+            with self.lock:
+                try:
+                    candles = self._stale_or_raise(key, time.monotonic())
+                except BinanceRateLimited:
+                    candles = None
+            if candles is None:
+                self._finish(key, future, exc=exc)
+                raise
+            self._finish(key, future, result=candles)
+            return candles
+        except Exception as exc:
+            self._finish(key, future, exc=exc)
+            raise
+
+        with self.lock:
+            self.cache[key] = (time.monotonic(), candles)
+        self._finish(key, future, result=candles)
+        return candles
+
+    # -----------------------------
+    # INTERNALS
+    # -----------------------------
+    def _finish(self, key, future: Future, result=None, exc: Optional[BaseException] = None):
+        with self.lock:
+            self.in_flight.pop(key, None)
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+
+    def _stale_or_raise(self, key, now: float):
+        """Caller must hold self.lock."""
+        cached = self.cache.get(key)
+        if cached and now - cached[0] < STALE_TTL_SECONDS:
+            return cached[1]
+        raise BinanceRateLimited(max(self.banned_until - now, 0))
+
+    def _fetch(self, symbol: str, interval: str, limit: int) -> List[Dict[str, float]]:
+        if limit <= KLINES_PAGE_SIZE:
+            return parse_klines(self._request({"symbol": symbol, "interval": interval, "limit": limit}))
+
+        # Longer history: page forward with startTime from `limit` candles ago
+        step = INTERVAL_MINUTES[interval] * 60_000
+        start = (int(time.time() * 1000) // step - limit + 1) * step
+
+        raw = []
+        while len(raw) < limit:
+            page_limit = min(KLINES_PAGE_SIZE, limit - len(raw))
+            page = self._request({
+                "symbol": symbol,
+                "interval": interval,
+                "startTime": start,
+                "limit": page_limit,
+            })
+            raw.extend(page)
+            if len(page) < page_limit:
+                break
+            start = page[-1][0] + step
+
+        return parse_klines(raw[-limit:])
+
+    def _request(self, params: Dict[str, Any]) -> List[list]:
+        self.bucket.acquire(klines_weight(params["limit"]))
+
+        response = self.session.get(self.base_url + KLINES_PATH, params=params, timeout=10)
+
+        used = response.headers.get("X-MBX-USED-WEIGHT-1M") or response.headers.get("X-MBX-USED-WEIGHT")
+        if used is not None and used.isdigit():
+            self.bucket.sync_used(int(used))
+
+        # 429 = over the limit, 418 = IP banned for ignoring 429s
+        if response.status_code in (418, 429):
+            retry_after = response.headers.get("Retry-After")
+            ban_seconds = float(retry_after) if retry_after and retry_after.isdigit() else DEFAULT_BAN_SECONDS
+            with self.lock:
+                self.banned_until = max(self.banned_until, time.monotonic() + ban_seconds)
+            print(f"⚠️ Binance returned {response.status_code}, backing off {ban_seconds:.0f}s")
+            raise BinanceRateLimited(ban_seconds)
+
+        response.raise_for_status()
+        return response.json()
+
+
+binance_client = BinanceClient()
+
+
+def get_klines(symbol: str, interval: str, range_value: str, warmup_bars: int = 0):
+    """
+    Fetch historical candles from Binance (rate-limited, coalesced, cached).
+    `warmup_bars` extra candles before the range are fetched for indicators
+    that need more history than the range itself (paged past the 1000 limit).
+    """
 
-    return candles
+    limit = min(calculate_limit(range_value, interval) + warmup_bars, MAX_HISTORY_BARS)
+    return binance_client.get_klines(f"{symbol}USDT", interval, limit)
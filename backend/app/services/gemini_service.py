@@ -1,256 +1,403 @@
 # File: app/services/gemini_service.py
 
-import requests
+import copy
 import os
-import json
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from cachetools import LRUCache
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+from app.utils.json_cleaner import extract_json
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite")
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com").rstrip("/")
+
+# v1beta exposes systemInstruction + responseSchema (structured output)
+GEMINI_URL = f"{GEMINI_API_BASE}/v1beta/models/{GEMINI_MODEL}:generateContent"
+
+HEADERS = {"Content-Type": "application/json", "x-goog-api-key": GEMINI_API_KEY or ""}
+GEMINI_TIMEOUT_SECONDS = 30
+
+RESULT_CACHE_SIZE = 512
+
+INDICATORS = ["RSI", "EMA20", "EMA50", "EMA100", "EMA200", "MACD", "Price"]
+EMA_INDICATORS = ["EMA20", "EMA50", "EMA100", "EMA200"]
+CONDITIONS = ["crosses_above", "crosses_below", "<", ">", "above", "below"]
+TIMEFRAMES = ["15m", "1h", "4h", "1d"]
+SMA_PERIODS = [10, 20, 50, 100, 200]   # the SMA columns apply_indicators builds
+
+
+# -----------------------------
+# TYPED RULES
+# -----------------------------
+class MovingAverage(BaseModel):
+    period: int = Field(..., gt=0)
+
+
+class RuleCondition(BaseModel):
+    indicator: Optional[str] = None
+    condition: Optional[str] = None
+    value: Optional[float] = None
+    compare_to: Optional[str] = None
+    moving_average: Optional[MovingAverage] = None
+    timeframe: Optional[str] = None
+    all: Optional[List["RuleCondition"]] = None
+
+    @field_validator("indicator", "compare_to")
+    @classmethod
+    def normalize_name(cls, name: Optional[str]) -> Optional[str]:
+        if name is None:
+            return None
+        return "Price" if name.upper() == "PRICE" else name.upper()
+
+    def problems(self, path: str) -> List[str]:
+        """What the backtest engine couldn't run in this condition."""
+        if self.all is not None:
+            if not self.all:
+                return [f"{path}.all is empty"]
+            return [p for i, sub in enumerate(self.all) for p in sub.problems(f"{path}.all[{i}]")]
+
+        found = []
+        if self.indicator not in INDICATORS:
+            found.append(f"{path}.indicator must be one of {INDICATORS}")
+        if self.condition not in CONDITIONS:
+            found.append(f"{path}.condition must be one of {CONDITIONS}")
+        if self.indicator == "RSI" and self.value is None:
+            found.append(f"{path}.value is required for RSI")
+        if self.indicator == "Price":
+            if self.moving_average is None:
+                found.append(f"{path}.moving_average.period is required for Price")
+            if self.condition not in ("crosses_above", "crosses_below"):
+                found.append(f"{path}.condition must be crosses_above/crosses_below for Price")
+        if self.moving_average is not None and self.moving_average.period not in SMA_PERIODS:
+            found.append(f"{path}.moving_average.period must be one of {SMA_PERIODS}")
+        if self.compare_to is not None:
+            if self.indicator not in EMA_INDICATORS:
+                found.append(f"{path}.compare_to is only supported when indicator is an EMA")
+            elif self.compare_to not in EMA_INDICATORS:
+                found.append(f"{path}.compare_to must be one of {EMA_INDICATORS}")
+        if self.timeframe is not None and self.timeframe not in TIMEFRAMES:
+            found.append(f"{path}.timeframe must be one of {TIMEFRAMES}")
+        return found
+
+
+class StrategyRules(BaseModel):
+    buy: RuleCondition = Field(default_factory=RuleCondition)
+    sell: RuleCondition = Field(default_factory=RuleCondition)
+
+
+class StrategyValidation(BaseModel):
+    valid: bool
+    error: Optional[str] = None
+    suggestions: List[str] = Field(default_factory=list)
+    rules: StrategyRules = Field(default_factory=StrategyRules)
+
+    def problems(self) -> List[str]:
+        if not self.valid:
+            return []
+        return self.rules.buy.problems("rules.buy") + self.rules.sell.problems("rules.sell")
+
+    def to_response(self) -> Dict[str, Any]:
+        """Same dict shape the routes and backtest engine have always used."""
+        return {
+            "valid": self.valid,
+            "error": self.error,
+            "suggestions": self.suggestions,
+            "rules": {
+                "buy": self.rules.buy.model_dump(exclude_none=True),
+                "sell": self.rules.sell.model_dump(exclude_none=True),
+            },
+        }
+
+
+# -----------------------------
+# RESPONSE SCHEMA (Gemini OpenAPI subset - no $ref, so nesting is spelled out)
+# -----------------------------
+CONDITION_PROPERTIES = {
+    "indicator": {"type": "STRING", "enum": INDICATORS},
+    "condition": {"type": "STRING", "enum": CONDITIONS},
+    "value": {"type": "NUMBER", "nullable": True},
+    "compare_to": {"type": "STRING", "enum": EMA_INDICATORS, "nullable": True},
+    "moving_average": {
+        "type": "OBJECT",
+        # Integer enums aren't supported by the schema subset; problems() enforces it
+        "properties": {"period": {"type": "INTEGER", "description": f"One of {SMA_PERIODS}"}},
+        "required": ["period"],
+        "nullable": True,
+    },
+    "timeframe": {"type": "STRING", "enum": TIMEFRAMES, "nullable": True},
+}
+
+CONDITION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        **CONDITION_PROPERTIES,
+        "all": {
+            "type": "ARRAY",
+            "items": {"type": "OBJECT", "properties": CONDITION_PROPERTIES},
+            "nullable": True,
+        },
+    },
+}
+
+VALIDATION_PROPERTIES = {
+    "valid": {"type": "BOOLEAN"},
+    "error": {"type": "STRING", "nullable": True},
+    "suggestions": {"type": "ARRAY", "items": {"type": "STRING"}},
+    "rules": {
+        "type": "OBJECT",
+        "properties": {"buy": CONDITION_SCHEMA, "sell": CONDITION_SCHEMA},
+        "required": ["buy", "sell"],
+    },
+}
+
+VALIDATION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": VALIDATION_PROPERTIES,
+    "required": ["valid", "suggestions", "rules"],
+    "propertyOrdering": ["valid", "error", "suggestions", "rules"],
+}
+
+BATCH_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "results": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"index": {"type": "INTEGER"}, **VALIDATION_PROPERTIES},
+                "required": ["index", "valid", "suggestions", "rules"],
+            },
+        },
+    },
+    "required": ["results"],
+}
+
+# The schema enforces the format, so the instructions only carry the semantics.
+# Built once and sent as systemInstruction on every call.
+SYSTEM_PROMPT = """You turn crypto trading strategies written in plain English into rules for a backtest engine.
+
+A strategy is valid only if it has BOTH a buy and a sell condition. Do not require stop loss, take profit,
+indicator parameters or risk management. Reject only incomplete or nonsensical strategies ("buy when moon"):
+valid=false, a short error, 1-3 suggestions, empty buy/sell.
+
+Rules:
+- RSI: value is the threshold (0-100), e.g. {"indicator":"RSI","condition":"<","value":30}
+- Price vs EMA: indicator EMA20/EMA50/EMA100/EMA200, no value, e.g. {"indicator":"EMA20","condition":"crosses_above"}
+- EMA vs EMA: indicator is the faster EMA, compare_to the slower one, e.g.
+  {"indicator":"EMA20","condition":"crosses_above","compare_to":"EMA50"}
+- SMA: {"indicator":"Price","condition":"crosses_above","moving_average":{"period":50}},
+  period is one of 10, 20, 50, 100, 200
+- MACD: compared with its signal line, no value
+- "above"/"below" mean the same as ">"/"<"
+- timeframe: only when the user names a higher timeframe for that condition
+- all: only to combine conditions that must hold together, e.g. "buy when RSI < 30 only if the daily
+  price is above EMA200" -> {"all":[{"indicator":"RSI","condition":"<","value":30},
+  {"indicator":"EMA200","condition":"above","timeframe":"1d"}]}"""
+
+SYSTEM_INSTRUCTION = {"parts": [{"text": SYSTEM_PROMPT}]}
+
+session = requests.Session()
+
+result_cache: LRUCache = LRUCache(maxsize=RESULT_CACHE_SIZE)
+result_cache_lock = threading.Lock()
+
+
+# -----------------------------
+# GEMINI CALLS
+# -----------------------------
+def call_gemini(contents: List[Dict[str, Any]], schema: Dict[str, Any]) -> Optional[str]:
+    """One structured-output generateContent call. Returns the JSON text or None."""
+    payload = {
+        "systemInstruction": SYSTEM_INSTRUCTION,
+        "contents": contents,
+        "generationConfig": {
+            "responseMimeType": "application/json",
+            "responseSchema": schema,
+            "temperature": 0,
+        },
+    }
 
-GEMINI_URL = (
-    f"https://generativelanguage.googleapis.com/v1/models/"
-    f"{GEMINI_MODEL}:generateContent?key={GEMINI_API_KEY}"
-)
-
-HEADERS = {"Content-Type": "application/json"}
+    try:
+        response = session.post(GEMINI_URL, headers=HEADERS, json=payload, timeout=GEMINI_TIMEOUT_SECONDS)
+    except requests.RequestException as exc:
+        print("❌ Gemini request failed:", exc)
+        return None
 
+    if response.status_code != 200:
+        print("❌ Gemini API error:", response.status_code, response.text[:500])
+        return None
 
-def validate_strategy_with_gemini(strategy: str):
-    """
-    Gemini validator with STRICT output format that matches the backtest engine.
-    """
+    try:
+        return response.json()["candidates"][0]["content"]["parts"][0]["text"]
+    except (KeyError, IndexError, ValueError) as exc:
+        print("❌ Gemini returned no content:", exc)
+        return None
 
-    prompt = f"""
-You are a crypto trading strategy validator and rule generator.
-
-The user wrote a strategy:
-\"{strategy}\"
-
-Your tasks:
-1. Determine if the strategy is complete (has BOTH buy AND sell conditions).
-2. If incomplete → valid=false with suggestions.
-3. If complete → valid=true with structured rules.
-
-ACCEPTANCE RULES:
-✅ ACCEPT these strategies (they are valid):
-- "Buy when RSI < 30, sell when RSI > 70"
-- "Buy when price crosses above 20 EMA, sell when crosses below"
-- "Buy when 20 EMA crosses above 50 EMA, sell when crosses below"
-- "Buy when MACD > signal, sell when MACD < signal"
-- "Buy when price crosses above 50 SMA, sell when crosses below"
-
-❌ REJECT only if:
-- Missing buy OR sell condition entirely
-- Completely nonsensical (e.g., "buy when moon")
-
-DO NOT require:
-- Stop loss or take profit
-- Multiple confirmations
-- Specific indicator parameters
-- Risk management rules
-
-CRITICAL: You MUST output rules in this EXACT format. NO other format is acceptable.
-
-SUPPORTED INDICATORS:
-- RSI (values 0-100)
-- EMA20, EMA50, EMA100, EMA200
-- SMA (any period via Price + moving_average object)
-- MACD
-
-OUTPUT FORMAT (STRICT):
-
-{{
-  "valid": true,
-  "error": null,
-  "suggestions": [],
-  "rules": {{
-    "buy": {{
-      "indicator": "INDICATOR_NAME",
-      "condition": "CONDITION_TYPE",
-      "value": NUMBER_OR_NULL
-    }},
-    "sell": {{
-      "indicator": "INDICATOR_NAME",
-      "condition": "CONDITION_TYPE",
-      "value": NUMBER_OR_NULL
-    }}
-  }}
-}}
-
-EXACT EXAMPLES YOU MUST FOLLOW:
-
-1. RSI Strategy:
-Strategy: "Buy when RSI < 30, sell when RSI > 70"
-Output:
-{{
-  "valid": true,
-  "error": null,
-  "suggestions": [],
-  "rules": {{
-    "buy": {{
-      "indicator": "RSI",
-      "condition": "<",
-      "value": 30
-    }},
-    "sell": {{
-      "indicator": "RSI",
-      "condition": ">",
-      "value": 70
-    }}
-  }}
-}}
-
-2. EMA Crossover (Price vs EMA):
-Strategy: "Buy when price crosses above 20 EMA, sell when crosses below"
-Output:
-{{
-  "valid": true,
-  "error": null,
-  "suggestions": [],
-  "rules": {{
-    "buy": {{
-      "indicator": "EMA20",
-      "condition": "crosses_above",
-      "value": null
-    }},
-    "sell": {{
-      "indicator": "EMA20",
-      "condition": "crosses_below",
-      "value": null
-    }}
-  }}
-}}
-
-3. EMA Crossover (EMA vs EMA):
-Strategy: "Buy when 20 EMA crosses above 50 EMA, sell when crosses below"
-Output:
-{{
-  "valid": true,
-  "error": null,
-  "suggestions": [],
-  "rules": {{
-    "buy": {{
-      "indicator": "EMA20",
-      "condition": "crosses_above",
-      "compare_to": "EMA50"
-    }},
-    "sell": {{
-      "indicator": "EMA20",
-      "condition": "crosses_below",
-      "compare_to": "EMA50"
-    }}
-  }}
-}}
-
-4. SMA Crossover:
-Strategy: "Buy when price crosses above 50 SMA, sell when crosses below"
-Output:
-{{
-  "valid": true,
-  "error": null,
-  "suggestions": [],
-  "rules": {{
-    "buy": {{
-      "indicator": "Price",
-      "condition": "crosses_above",
-      "moving_average": {{
-        "period": 50
-      }}
-    }},
-    "sell": {{
-      "indicator": "Price",
-      "condition": "crosses_below",
-      "moving_average": {{
-        "period": 50
-      }}
-    }}
-  }}
-}}
-
-5. MACD Strategy:
-Strategy: "Buy when MACD crosses above signal, sell when crosses below"
-Output:
-{{
-  "valid": true,
-  "error": null,
-  "suggestions": [],
-  "rules": {{
-    "buy": {{
-      "indicator": "MACD",
-      "condition": "crosses_above",
-      "value": null
-    }},
-    "sell": {{
-      "indicator": "MACD",
-      "condition": "crosses_below",
-      "value": null
-    }}
-  }}
-}}
-
-CONDITION TYPES (use these exact strings):
-- "crosses_above" - for crossovers going up
-- "crosses_below" - for crossovers going down
-- "<" - for less than comparisons
-- ">" - for greater than comparisons
-- "above" - for above comparisons (same as >)
-- "below" - for below comparisons (same as <)
-
-CRITICAL RULES:
-1. Indicator names must be UPPERCASE: RSI, EMA20, EMA50, MACD, Price
-2. Use "condition" field (NOT "operator")
-3. For SMA: indicator must be "Price" with nested "moving_average" object
-4. For EMA vs EMA: use "compare_to" field
-5. Always set value to null if not comparing to a number
-6. Never add extra fields beyond the examples shown
-
-Respond ONLY with valid JSON. No code fences. No explanatory text. Just the JSON object.
-"""
 
-    payload = {
-        "contents": [
-            {
-                "parts": [
-                    {"text": prompt}
-                ]
-            }
-        ]
-    }
+def parse_validation(data: Any) -> Tuple[Optional[StrategyValidation], List[str]]:
+    """Validate one result object. Returns (result, []) or (None, problems)."""
+    try:
+        result = StrategyValidation.model_validate(data)
+    except ValidationError as exc:
+        return None, [f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in exc.errors()]
 
-    response = requests.post(GEMINI_URL, headers=HEADERS, json=payload)
+    problems = result.problems()
+    return (None, problems) if problems else (result, [])
 
-    if response.status_code != 200:
-        print("❌ Gemini API error:", response.text)
-        return None
 
+def parse_text(raw: str) -> Tuple[Optional[StrategyValidation], List[str]]:
     try:
-        raw = response.json()["candidates"][0]["content"]["parts"][0]["text"]
-        print("\n" + "="*60)
-        print("📤 RAW GEMINI OUTPUT:")
-        print("="*60)
-        print(raw)
-        print("="*60 + "\n")
+        data = extract_json(raw)
+    except ValueError as exc:
+        return None, [f"Response is not valid JSON: {exc}"]
+    return parse_validation(data)
 
-        # Clean response
-        clean = raw.strip()
-        clean = clean.replace("```json", "").replace("```", "").strip()
 
-        data = json.loads(clean)
+def user_turn(text: str) -> Dict[str, Any]:
+    return {"role": "user", "parts": [{"text": text}]}
 
-        # Safety enforcement
-        if "rules" not in data or not isinstance(data["rules"], dict):
-            data["rules"] = {"buy": {}, "sell": {}}
 
-        data["rules"].setdefault("buy", {})
-        data["rules"].setdefault("sell", {})
+def cache_key(strategy: str) -> str:
+    return re.sub(r"\s+", " ", strategy.strip().lower())
 
-        print("✅ Parsed rules:")
-        print(json.dumps(data["rules"], indent=2))
-        print()
 
-        return data
+def cache_get(strategy: str) -> Optional[Dict[str, Any]]:
+    with result_cache_lock:
+        cached = result_cache.get(cache_key(strategy))
+    # Callers mutate the rules (setdefault etc.), so hand out copies
+    return copy.deepcopy(cached) if cached is not None else None
 
-    except Exception as e:
-        print("❌ Gemini parse error:", e)
-        print("Raw response:", raw if 'raw' in locals() else "No response")
-        return None
\ No newline at end of file
+
+def cache_put(strategy: str, response: Dict[str, Any]):
+    with result_cache_lock:
+        result_cache[cache_key(strategy)] = copy.deepcopy(response)
+
+
+# -----------------------------
+# PUBLIC
+# -----------------------------
+def validate_strategy_with_gemini(strategy: str, repair: bool = True):
+    """
+    Validate a strategy and turn it into engine rules using Gemini structured output.
+    Output that doesn't fit the rules model gets exactly one repair round-trip
+    (none with repair=False).
+    Returns {"valid", "error", "suggestions", "rules"} or None if Gemini failed.
+    """
+    cached = cache_get(strategy)
+    if cached is not None:
+        return cached
+
+    contents = [user_turn(f"Strategy: {strategy}")]
+    raw = call_gemini(contents, VALIDATION_SCHEMA)
+    if raw is None:
+        return None
+
+    result, problems = parse_text(raw)
+
+    if result is None and not repair:
+        print("❌ Gemini rules unusable:", problems)
+        return None
+
+    if result is None:
+        print("⚠️ Gemini rules need repair:", problems)
+        contents += [
+            {"role": "model", "parts": [{"text": raw}]},
+            user_turn("Fix these problems and answer again with the full JSON:\n- " + "\n- ".join(problems)),
+        ]
+        raw = call_gemini(contents, VALIDATION_SCHEMA)
+        if raw is None:
+            return None
+
+        result, problems = parse_text(raw)
+        if result is None:
+            print("❌ Gemini repair failed:", problems)
+            return None
+
+    response = result.to_response()
+    cache_put(strategy, response)
+    return response
+
+
+def parse_batch(raw: str, indices: List[int]) -> Tuple[Dict[int, StrategyValidation], Dict[int, List[str]]]:
+    """
+    Split a batch answer into per-index results.
+    Returns (valid results, problems) keyed by index; every index in
+    `indices` ends up in exactly one of the two.
+    """
+    try:
+        data = extract_json(raw)
+        items = {item.get("index"): item for item in data.get("results", []) if isinstance(item, dict)}
+    except (ValueError, AttributeError) as exc:
+        print("⚠️ Gemini batch response unusable:", exc)
+        return {}, {i: [f"Response is not valid JSON: {exc}"] for i in indices}
+
+    results: Dict[int, StrategyValidation] = {}
+    problems: Dict[int, List[str]] = {}
+    for i in indices:
+        item = items.get(i)
+        if item is None:
+            problems[i] = ["missing from results"]
+            continue
+        result, found = parse_validation({k: v for k, v in item.items() if k != "index"})
+        if result is None:
+            problems[i] = found
+        else:
+            results[i] = result
+    return results, problems
+
+
+def validate_strategies_with_gemini(strategies: List[str]) -> List[Optional[Dict[str, Any]]]:
+    """
+    Validate many strategies with a single model call.
+    Cached strategies are skipped. Items the batch answer gets wrong get one
+    shared repair turn listing only those items; whatever is still wrong after
+    that falls back to a single-strategy call without its own repair, so the
+    worst case is 2 + N calls. If a batch call itself fails, nothing is retried.
+    Returns one response (or None) per input, in order.
+    """
+    responses: List[Optional[Dict[str, Any]]] = [cache_get(s) for s in strategies]
+    pending = [i for i, r in enumerate(responses) if r is None]
+
+    def accept(results: Dict[int, StrategyValidation]):
+        for i, result in results.items():
+            responses[i] = result.to_response()
+            cache_put(strategies[i], responses[i])
+
+    if len(pending) > 1:
+        listing = "\n".join(f"{i}. {strategies[i]}" for i in pending)
+        contents = [user_turn(f"Validate each strategy separately; set index to its number.\n{listing}")]
+        raw = call_gemini(contents, BATCH_SCHEMA)
+        if raw is None:
+            return responses
+
+        results, problems = parse_batch(raw, pending)
+        accept(results)
+
+        if problems:
+            print("⚠️ Gemini batch needs repair:", problems)
+            failed = "\n".join(
+                f"{i}. {strategies[i]}\n" + "\n".join(f"   - {p}" for p in found)
+                for i, found in problems.items()
+            )
+            contents += [
+                {"role": "model", "parts": [{"text": raw}]},
+                user_turn(f"Fix these problems and answer again with results for only these strategies:\n{failed}"),
+            ]
+            raw = call_gemini(contents, BATCH_SCHEMA)
+            if raw is None:
+                return responses
+
+            results, _ = parse_batch(raw, list(problems))
+            accept(results)
+
+    # A lone strategy never went through the batch, so it keeps its own repair pass
+    for i in pending:
+        if responses[i] is None:
+            responses[i] = validate_strategy_with_gemini(strategies[i], repair=len(pending) == 1)
+
+    return responses
@@ -0,0 +1,95 @@
+# File: app/services/google_auth_service.py
+
+import hashlib
+import re
+import threading
+import time
+from typing import Any, Dict, Tuple
+
+import requests
+from cachetools import TLRUCache
+from google.auth import transport
+from google.auth.transport.requests import Request as GoogleRequest
+from google.oauth2 import id_token
+
+from app.core.config import settings
+
+VERIFIED_TOKEN_CACHE_SIZE = 10_000
+DEFAULT_CERT_TTL_SECONDS = 300   # when Google sends no usable Cache-Control
+
+MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+class CachingCertRequest(transport.Request):
+    """
+    google-auth transport that caches GET responses (Google's signing certs)
+    for as long as the upstream Cache-Control max-age / Age headers allow,
+    instead of refetching them on every login.
+    """
+
+    def __init__(self):
+        self.inner = GoogleRequest(session=requests.Session())
+        self.cache: Dict[str, Tuple[float, Any]] = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, url, method="GET", body=None, headers=None, timeout=None, **kwargs):
+        if method != "GET":
+            return self.inner(url, method=method, body=body, headers=headers, timeout=timeout, **kwargs)
+
+        now = time.time()
+        with self.lock:
+            cached = self.cache.get(url)
+            if cached and cached[0] > now:
+                return cached[1]
+
+        response = self.inner(url, method=method, body=body, headers=headers, timeout=timeout, **kwargs)
+        if response.status == 200:
+            ttl = self._ttl(response.headers)
+            if ttl > 0:
+                with self.lock:
+                    self.cache[url] = (now + ttl, response)
+        return response
+
+    @staticmethod
+    def _ttl(headers) -> float:
+        cache_control = (headers.get("Cache-Control") or headers.get("cache-control") or "").lower()
+        if "no-store" in cache_control or "no-cache" in cache_control:
+            return 0
+
+        match = MAX_AGE_RE.search(cache_control)
+        if not match:
+            return DEFAULT_CERT_TTL_SECONDS
+
+        age = headers.get("Age") or headers.get("age") or "0"
+        return int(match.group(1)) - (int(age) if age.isdigit() else 0)
+
+
+cert_request = CachingCertRequest()
+
+# sha256(token) -> claims, each entry expires at the token's own "exp"
+verified_tokens = TLRUCache(
+    maxsize=VERIFIED_TOKEN_CACHE_SIZE,
+    ttu=lambda _key, claims, _now: claims.get("exp", 0),
+    timer=time.time,
+)
+verified_lock = threading.Lock()
+
+
+def verify_google_id_token(token: str) -> Tuple[Dict[str, Any], bool]:
+    """
+    Verify a Google ID token.
+    Returns (claims, cached) - `cached` is True when the same token was already
+    verified and hasn't expired, in which case no crypto or network work is done.
+    """
+    key = hashlib.sha256(token.encode()).hexdigest()
+
+    with verified_lock:
+        claims = verified_tokens.get(key)
+    if claims is not None:
+        return claims, True
+
+    claims = id_token.verify_oauth2_token(token, cert_request, settings.GOOGLE_CLIENT_ID)
+
+    with verified_lock:
+        verified_tokens[key] = claims
+    return claims, False
@@ -0,0 +1,262 @@
+# File: app/services/portfolio_engine.py
+
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import STARTING_EQUITY
+from app.services.backtest_engine import format_timestamps, prepare_frame, signal_mask
+from app.services.timeframes import required_timeframes
+
+MAX_FETCH_WORKERS = 8
+
+
+# -----------------------------
+# ALIGN ASSETS
+# -----------------------------
+def align_frames(frames: Dict[str, pd.DataFrame]) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Put every asset on the common time index (bars all assets have).
+    Returns (timestamps, panel) where panel maps column -> (time x assets) array,
+    with assets in the order of `frames`.
+    """
+    common = None
+    for df in frames.values():
+        index = pd.Index(df["timestamp"])
+        common = index if common is None else common.intersection(index)
+
+    if common is None or len(common) == 0:
+        raise ValueError("Assets have no overlapping candles for this timeframe/range.")
+    common = common.sort_values()
+
+    columns = set.intersection(*(set(df.columns) for df in frames.values())) - {"timestamp"}
+    indexed = [df.set_index("timestamp").loc[common] for df in frames.values()]
+
+    panel = {
+        col: np.column_stack([d[col].to_numpy(dtype=float) for d in indexed])
+        for col in columns
+    }
+    return common.to_numpy(), panel
+
+
+# -----------------------------
+# SHARED-CAPITAL SIMULATION
+# -----------------------------
+def simulate_portfolio(
+    close: np.ndarray,
+    buy: np.ndarray,
+    sell: np.ndarray,
+    max_positions: int,
+    rebalance_every: Optional[int] = None,
+    starting_equity: float = STARTING_EQUITY,
+) -> Dict[str, Any]:
+    """
+    Run one capital pool over (time x assets) signal arrays.
+
+    - Exits are processed before entries on each bar; an asset that exits
+      can't re-enter on the same bar (same as the single-asset engine).
+    - Each new position gets equity / max_positions, split evenly when cash
+      can't cover every simultaneous signal. When there are more signals than
+      free slots, assets earlier in the request win.
+    - Every `rebalance_every` bars open positions are resized back to
+      equity / max_positions. P/L realized by trimming a position is added
+      to that position's closing trade, so closed trades' pl_usd adds up to
+      their realized P/L.
+
+    Only bars with a signal or rebalance are visited; holdings are constant in
+    between, so the equity curve is rebuilt afterwards by forward-filling.
+    """
+    n_bars, n_assets = close.shape
+
+    cash = starting_equity
+    units = np.zeros(n_assets)
+    cost_basis = np.zeros(n_assets)
+    realized = np.zeros(n_assets)
+    trim_pl = np.zeros(n_assets)   # realized by rebalance trims of the open position
+    entry_bar = np.full(n_assets, -1)
+
+    trade_asset: List[int] = []
+    trade_entry: List[int] = []
+    trade_exit: List[int] = []
+    trade_pl_usd: List[float] = []
+
+    event = buy.any(axis=1) | sell.any(axis=1)
+    if rebalance_every:
+        event[rebalance_every::rebalance_every] = True
+
+    snap_bars = [0]
+    snap_cash = [cash]
+    snap_units = [units.copy()]
+
+    for t in np.flatnonzero(event).tolist():
+        price = close[t]
+        held = units > 0
+
+        # EXITS
+        exiting = held & sell[t]
+        if exiting.any():
+            proceeds = units[exiting] * price[exiting]
+            pl_usd = proceeds - cost_basis[exiting]
+            cash += proceeds.sum()
+            realized[exiting] += pl_usd
+            pl_usd += trim_pl[exiting]
+
+            exited = np.flatnonzero(exiting)
+            trade_asset.extend(exited.tolist())
+            trade_entry.extend(entry_bar[exited].tolist())
+            trade_exit.extend([t] * len(exited))
+            trade_pl_usd.extend(pl_usd.tolist())
+
+            units[exiting] = 0.0
+            cost_basis[exiting] = 0.0
+            trim_pl[exiting] = 0.0
+            entry_bar[exiting] = -1
+
+        target = (cash + units @ price) / max_positions
+
+        # ENTRIES
+        free_slots = max_positions - int((units > 0).sum())
+        candidates = np.flatnonzero(~held & buy[t])
+        if free_slots > 0 and len(candidates):
+            chosen = candidates[:free_slots]
+            allocation = min(target, cash / len(chosen))
+            if allocation > 0:
+                units[chosen] = allocation / price[chosen]
+                cost_basis[chosen] = allocation
+                entry_bar[chosen] = t
+                cash -= allocation * len(chosen)
+
+        # REBALANCE
+        if rebalance_every and t % rebalance_every == 0:
+            open_pos = units > 0
+            if open_pos.any():
+                target_units = target / price[open_pos]
+                delta = target_units - units[open_pos]
+                avg_cost = cost_basis[open_pos] / units[open_pos]
+
+                # Trims realize P/L against average cost, adds raise the basis
+                trimmed = np.minimum(delta, 0.0)
+                trim_gain = -trimmed * (price[open_pos] - avg_cost)
+                realized[open_pos] += trim_gain
+                trim_pl[open_pos] += trim_gain
+                cost_basis[open_pos] += trimmed * avg_cost + np.maximum(delta, 0.0) * price[open_pos]
+
+                cash -= (delta * price[open_pos]).sum()
+                units[open_pos] = target_units
+
+        snap_bars.append(t)
+        snap_cash.append(cash)
+        snap_units.append(units.copy())
+
+    # Forward-fill holdings to every bar and mark to market
+    which = np.searchsorted(np.asarray(snap_bars), np.arange(n_bars), side="right") - 1
+    cash_by_bar = np.asarray(snap_cash)[which]
+    units_by_bar = np.vstack(snap_units)[which]
+    equity_curve = cash_by_bar + (units_by_bar * close).sum(axis=1)
+
+    return {
+        "equity_curve": equity_curve,
+        "realized": realized,
+        "unrealized": units * close[-1] - cost_basis,
+        "trade_asset": np.asarray(trade_asset, dtype=np.int64),
+        "trade_entry": np.asarray(trade_entry, dtype=np.int64),
+        "trade_exit": np.asarray(trade_exit, dtype=np.int64),
+        "trade_pl_usd": np.asarray(trade_pl_usd, dtype=float),
+    }
+
+
+# -----------------------------
+# PORTFOLIO BACKTEST
+# -----------------------------
+def run_portfolio_backtest(
+    assets: List[str],
+    interval: str,
+    range_value: str,
+    rules: Dict[str, Any],
+    max_positions: Optional[int] = None,
+    rebalance_every: Optional[int] = None,
+) -> Dict[str, Any]:
+    assets = list(dict.fromkeys(a.upper() for a in assets))
+    if not assets:
+        raise ValueError("At least one asset is required.")
+
+    max_positions = max_positions or len(assets)
+    if max_positions < 1:
+        raise ValueError("max_positions must be at least 1.")
+
+    timeframes = required_timeframes([rules])
+
+    # Candles are I/O bound - fetch all assets concurrently
+    with ThreadPoolExecutor(max_workers=min(MAX_FETCH_WORKERS, len(assets))) as pool:
+        loaded = pool.map(lambda a: prepare_frame(a, interval, range_value, timeframes), assets)
+        frames = dict(zip(assets, loaded))
+
+    timestamps, panel = align_frames(frames)
+
+    # One pass evaluates every asset
+    buy = signal_mask(panel, rules.get("buy", {}))
+    sell = signal_mask(panel, rules.get("sell", {}))
+
+    close = panel["close"]
+    sim = simulate_portfolio(close, buy, sell, max_positions, rebalance_every)
+
+    equity_curve = sim["equity_curve"]
+    drawdown = equity_curve / np.maximum.accumulate(equity_curve) - 1
+
+    t_asset = sim["trade_asset"]
+    t_entry = sim["trade_entry"]
+    t_exit = sim["trade_exit"]
+    entry_prices = close[t_entry, t_asset]
+    exit_prices = close[t_exit, t_asset]
+    pl_pct = exit_prices / entry_prices - 1
+
+    trades = [
+        {
+            "asset": assets[a],
+            "entry_time": et,
+            "entry_price": ep,
+            "exit_time": xt,
+            "exit_price": xp,
+            "pl_pct": pp,
+            "pl_usd": pu,
+        }
+        for a, et, ep, xt, xp, pp, pu in zip(
+            t_asset.tolist(),
+            format_timestamps(timestamps[t_entry]).tolist(),
+            entry_prices.tolist(),
+            format_timestamps(timestamps[t_exit]).tolist(),
+            exit_prices.tolist(),
+            np.round(pl_pct, 6).tolist(),
+            np.round(sim["trade_pl_usd"], 2).tolist(),
+        )
+    ]
+
+    attribution = {}
+    for j, asset in enumerate(assets):
+        asset_pl = pl_pct[t_asset == j]
+        pnl = sim["realized"][j] + sim["unrealized"][j]
+        attribution[asset] = {
+            "trades": int(len(asset_pl)),
+            "win_ratio": float((asset_pl > 0).mean()) if len(asset_pl) else 0,
+            "realized_usd": round(float(sim["realized"][j]), 2),
+            "unrealized_usd": round(float(sim["unrealized"][j]), 2),
+            "contribution_pct": round(float(pnl / STARTING_EQUITY), 6),
+        }
+
+    total = len(pl_pct)
+    wins = int((pl_pct > 0).sum())
+
+    return {
+        "assets": assets,
+        "max_positions": max_positions,
+        "start": format_timestamps(timestamps[:1]).tolist()[0],
+        "end": format_timestamps(timestamps[-1:]).tolist()[0],
+        "win_ratio": (wins / total) if total else 0,
+        "total_trades": total,
+        "max_drawdown": round(float(drawdown.min()), 6),
+        "final_equity": round(float(equity_curve[-1]), 2),
+        "equity_curve": equity_curve,
+        "attribution": attribution,
+        "trades": trades,
+    }
@@ -0,0 +1,86 @@
+# File: app/services/robustness.py
+
+import numpy as np
+from typing import Any, Dict, Optional, Sequence
+
+from app.core.config import MAX_SIMULATED_TRADES, STARTING_EQUITY
+
+METHODS = ("bootstrap", "shuffle")
+
+
+def _interval(values: np.ndarray, confidence: float) -> Dict[str, float]:
+    tail = (1 - confidence) / 2 * 100
+    low, median, high = np.percentile(values, [tail, 50, 100 - tail])
+    return {
+        "mean": round(float(values.mean()), 6),
+        "low": round(float(low), 6),
+        "median": round(float(median), 6),
+        "high": round(float(high), 6),
+    }
+
+
+def resample_returns(
+    returns: np.ndarray,
+    simulations: int,
+    method: str,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """
+    Build a (simulations x trades) matrix of trade returns.
+    - bootstrap: draw trades with replacement (varies which trades happen)
+    - shuffle:   permute the real trades (varies only their order / path)
+    """
+    if method == "bootstrap":
+        picks = rng.integers(0, len(returns), size=(simulations, len(returns)))
+        return returns[picks]
+    if method == "shuffle":
+        return rng.permuted(np.broadcast_to(returns, (simulations, len(returns))), axis=1)
+    raise ValueError(f"Unknown method '{method}'. Use one of: {', '.join(METHODS)}")
+
+
+def monte_carlo(
+    trade_returns: Sequence[float],
+    simulations: int = 10_000,
+    method: str = "bootstrap",
+    seed: Optional[int] = None,
+    confidence: float = 0.95,
+    starting_equity: float = STARTING_EQUITY,
+) -> Dict[str, Any]:
+    """
+    Resample a backtest's per-trade returns (pl_pct) and report confidence
+    intervals for final equity, max drawdown and win ratio.
+    Every simulation is a row of one matrix, so there's no Python-level loop.
+    """
+    returns = np.asarray(trade_returns, dtype=float)
+    if returns.size == 0:
+        raise ValueError("No trades to resample.")
+    if (returns <= -1).any():
+        raise ValueError("Trade returns must be greater than -1 (a loss of at most 100%).")
+    if simulations * returns.size > MAX_SIMULATED_TRADES:
+        raise ValueError(
+            f"simulations x trades must be at most {MAX_SIMULATED_TRADES:,} "
+            f"(got {simulations:,} x {returns.size:,})."
+        )
+
+    rng = np.random.default_rng(seed)
+    sampled = resample_returns(returns, simulations, method, rng)
+
+    # Equity after each trade, with the starting balance as the first peak
+    paths = starting_equity * np.cumprod(1 + sampled, axis=1)
+    peaks = np.maximum(np.maximum.accumulate(paths, axis=1), starting_equity)
+    max_drawdown = (paths / peaks - 1).min(axis=1)
+
+    final_equity = paths[:, -1]
+    win_ratio = (sampled > 0).mean(axis=1)
+
+    return {
+        "method": method,
+        "simulations": simulations,
+        "trades": int(returns.size),
+        "seed": seed,
+        "confidence": confidence,
+        "final_equity": _interval(final_equity, confidence),
+        "max_drawdown": _interval(max_drawdown, confidence),
+        "win_ratio": _interval(win_ratio, confidence),
+        "probability_of_loss": round(float((final_equity < starting_equity).mean()), 6),
+    }
@@ -0,0 +1,133 @@
+# File: app/services/timeframes.py
+
+import pandas as pd
+from typing import Any, Dict, Iterable, Set
+from app.services.binance_service import INTERVAL_MINUTES, MAX_HISTORY_BARS, calculate_limit
+
+OHLCV_AGG = {
+    "open": "first",
+    "high": "max",
+    "low": "min",
+    "close": "last",
+    "volume": "sum",
+}
+
+# Longest lookback in apply_indicators (EMA200 / SMA200)
+INDICATOR_LOOKBACK_BARS = 200
+
+
+def rule_timeframes(rule: Dict[str, Any]) -> Set[str]:
+    """Collect every `timeframe` referenced by a (possibly composite) rule."""
+    if not isinstance(rule, dict):
+        return set()
+
+    found = set()
+    if rule.get("timeframe"):
+        found.add(rule["timeframe"])
+    for sub in rule.get("all") or []:
+        found |= rule_timeframes(sub)
+    return found
+
+
+def required_timeframes(rule_sets: Iterable[Dict[str, Any]]) -> Set[str]:
+    """Union of timeframes referenced by the buy/sell rules of every rule set."""
+    found = set()
+    for rules in rule_sets:
+        found |= rule_timeframes(rules.get("buy", {})) | rule_timeframes(rules.get("sell", {}))
+    return found
+
+
+def validate_higher_timeframe(base: str, higher: str):
+    base_minutes = INTERVAL_MINUTES.get(base)
+    higher_minutes = INTERVAL_MINUTES.get(higher)
+
+    if base_minutes is None or higher_minutes is None:
+        raise ValueError(f"Invalid timeframe: {higher}")
+    if higher_minutes <= base_minutes or higher_minutes % base_minutes:
+        raise ValueError(f"Timeframe {higher} must be a multiple of the base timeframe {base}")
+
+
+def timeframe_warmup(base_interval: str, timeframe: str) -> int:
+    """
+    Base candles needed before the requested range so `timeframe` indicators
+    have INDICATOR_LOOKBACK_BARS closed bars by the first base bar
+    (e.g. EMA200 on 1d from a 1h base needs ~200 days of 1h candles).
+    Two extra buckets cover the partial first bucket and the one still open.
+    """
+    if timeframe == base_interval:
+        return 0
+    validate_higher_timeframe(base_interval, timeframe)
+    ratio = INTERVAL_MINUTES[timeframe] // INTERVAL_MINUTES[base_interval]
+    return (INDICATOR_LOOKBACK_BARS + 2) * ratio
+
+
+def warmup_bars(base_interval: str, timeframes: Set[str]) -> int:
+    """Extra base candles the requested higher timeframes need (see `timeframe_warmup`)."""
+    return max((timeframe_warmup(base_interval, tf) for tf in timeframes), default=0)
+
+
+def check_history(base_interval: str, range_value: str, timeframes: Set[str]):
+    """
+    Raise ValueError when range + warm-up wouldn't fit in MAX_HISTORY_BARS
+    base candles, instead of fetching a truncated history whose
+    higher-timeframe indicators come out NaN or half warmed up.
+    """
+    limit = calculate_limit(range_value, base_interval)
+    for timeframe in sorted(timeframes):
+        needed = limit + timeframe_warmup(base_interval, timeframe)
+        if needed > MAX_HISTORY_BARS:
+            raise ValueError(
+                f"{timeframe} indicators on a {base_interval} base need {needed:,} candles of history "
+                f"(max {MAX_HISTORY_BARS:,}). Use a larger base timeframe."
+            )
+
+
+def resample_candles(df: pd.DataFrame, base_interval: str, timeframe: str) -> pd.DataFrame:
+    """
+    Build higher-timeframe OHLCV candles from base candles.
+    Buckets are anchored to the Unix epoch, which matches Binance's UTC
+    candle boundaries (daily bars open at 00:00, 4h bars at 00/04/08...).
+    Incomplete buckets (e.g. the first day when data starts mid-day) are dropped.
+    """
+    minutes = INTERVAL_MINUTES[timeframe]
+    bars_per_bucket = minutes // INTERVAL_MINUTES[base_interval]
+
+    grouped = df.set_index("timestamp")[list(OHLCV_AGG)].resample(
+        f"{minutes}min", label="left", closed="left", origin="epoch"
+    )
+    out = grouped.agg(OHLCV_AGG)
+    out = out[grouped["close"].count() == bars_per_bucket]
+
+    return out.reset_index()
+
+
+def align_higher_timeframe(
+    base: pd.DataFrame,
+    higher: pd.DataFrame,
+    base_interval: str,
+    timeframe: str,
+) -> pd.DataFrame:
+    """
+    As-of join higher-timeframe columns onto the base candles without lookahead.
+
+    A higher bar opening at T only becomes known once it closes at T + period,
+    and a base bar opening at t is evaluated at its close t + base_period, so
+    each base bar sees the latest higher bar with close <= its own close.
+    Joined columns are suffixed with "_<timeframe>" (e.g. "ema200_1d").
+    """
+    base_period = pd.Timedelta(minutes=INTERVAL_MINUTES[base_interval])
+    higher_period = pd.Timedelta(minutes=INTERVAL_MINUTES[timeframe])
+
+    right = higher.drop(columns=["timestamp"]).add_suffix(f"_{timeframe}")
+    right["_available_at"] = higher["timestamp"] + higher_period
+
+    left = base.assign(_close_time=base["timestamp"] + base_period)
+
+    merged = pd.merge_asof(
+        left,
+        right.sort_values("_available_at"),
+        left_on="_close_time",
+        right_on="_available_at",
+        direction="backward",
+    )
+    return merged.drop(columns=["_close_time", "_available_at"])
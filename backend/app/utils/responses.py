@@ -0,0 +1,40 @@
+# File: app/utils/responses.py
+
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+def _default(obj: Any):
+    """
+    Fallback for types orjson doesn't handle natively.
+    Handles:
+    - NumPy scalars (np.float64, np.int64, np.bool_)
+    - pandas Timestamps
+    """
+
+    if hasattr(obj, "item"):
+        return obj.item()
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    orjson-backed response that serializes NumPy arrays natively.
+
+    Return an instance directly from the route (instead of a dict) so
+    FastAPI skips `jsonable_encoder`, which walks every element in Python.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            default=_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+        )
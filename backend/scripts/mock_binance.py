@@ -0,0 +1,121 @@
+# File: scripts/mock_binance.py
+
+"""
+Local stand-in for the Binance klines endpoint.
+
+Serves synthetic candles with X-MBX-USED-WEIGHT-1M headers and, after
+--ban-after requests, answers 418 + Retry-After for --ban-seconds so the
+client's backoff / stale-cache path can be exercised without touching
+the real API. tests/test_binance_client.py runs it in-process.
+
+Usage:
+    python scripts/mock_binance.py --port 8081 --ban-after 3 --ban-seconds 30
+    BINANCE_API_BASE=http://localhost:8081 uvicorn app.main:app
+"""
+
+import argparse
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+INTERVAL_MS = {
+    "1m": 60_000,
+    "5m": 300_000,
+    "15m": 900_000,
+    "1h": 3_600_000,
+    "4h": 14_400_000,
+    "1d": 86_400_000,
+}
+
+
+def make_klines(interval: str, limit: int, start: Optional[int] = None):
+    """The last `limit` closed candles, or up to `limit` from `start` (startTime paging)."""
+    step = INTERVAL_MS.get(interval, 60_000)
+    last = int(time.time() * 1000) // step * step - step
+    first = last - (limit - 1) * step if start is None else start
+
+    rows = []
+    for ts in range(first, min(first + limit * step, last + step), step):
+        # Price depends on time only, so pages stitch together
+        price = 100 + 10 * math.sin(ts / step / 15)
+        rows.append([ts, str(price), str(price + 1), str(price - 1), str(price + 0.5), "10.0"])
+    return rows
+
+
+class MockState:
+    def __init__(self, ban_after: int, ban_seconds: int, delay: float = 0.0):
+        self.ban_after = ban_after
+        self.ban_seconds = ban_seconds
+        self.delay = delay
+        self.requests = 0
+        self.used_weight = 0
+        self.banned_until = 0.0
+        self.lock = threading.Lock()
+
+
+def make_handler(state: MockState):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != "/api/v3/klines":
+                self.send_error(404)
+                return
+
+            query = parse_qs(url.query)
+            interval = query.get("interval", ["1h"])[0]
+            limit = int(query.get("limit", ["500"])[0])
+            start = int(query["startTime"][0]) if "startTime" in query else None
+
+            with state.lock:
+                state.requests += 1
+                state.used_weight += 5
+                now = time.time()
+                if state.ban_after and state.requests > state.ban_after and not state.banned_until:
+                    state.banned_until = now + state.ban_seconds
+                banned = now < state.banned_until
+                used = state.used_weight
+
+            # Simulated latency, so concurrent callers overlap in flight
+            if state.delay:
+                time.sleep(state.delay)
+
+            if banned:
+                self.send_response(418)
+                self.send_header("Retry-After", str(int(state.banned_until - now) + 1))
+                self.end_headers()
+                return
+
+            body = json.dumps(make_klines(interval, limit, start)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("X-MBX-USED-WEIGHT-1M", str(used))
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            print("mock-binance:", fmt % args)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Binance klines server")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--ban-after", type=int, default=0, help="Requests before returning 418 (0 = never)")
+    parser.add_argument("--ban-seconds", type=int, default=30)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before answering")
+    args = parser.parse_args()
+
+    state = MockState(args.ban_after, args.ban_seconds, args.delay)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(state))
+    print(f"Mock Binance listening on http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# File: scripts/mock_gemini.py
+
+"""
+Local stand-in for Gemini's generateContent endpoint (structured output).
+
+Understands a handful of strategy phrasings ("RSI < 30", "MACD", "20 EMA",
+"50 SMA") well enough to return schema-shaped rules, answers batch requests,
+and with --malformed-first returns a broken answer to the first request of
+each conversation so the client's repair pass can be exercised.
+tests/test_gemini_service.py runs it in-process.
+
+Usage:
+    python scripts/mock_gemini.py --port 8082 --malformed-first
+    GEMINI_API_BASE=http://localhost:8082 uvicorn app.main:app
+"""
+
+import argparse
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def interpret(strategy: str):
+    text = strategy.lower()
+    if "buy" not in text or "sell" not in text:
+        return {
+            "valid": False,
+            "error": "Strategy needs both a buy and a sell condition.",
+            "suggestions": ["Add a sell condition, e.g. 'sell when RSI > 70'."],
+            "rules": {"buy": {}, "sell": {}},
+        }
+
+    buy_text, _, sell_text = text.partition("sell")
+
+    def side(part: str, default_condition: str):
+        rsi = re.search(r"rsi\s*([<>])\s*(\d+)", part)
+        if rsi:
+            return {"indicator": "RSI", "condition": rsi.group(1), "value": float(rsi.group(2))}
+        direction = "crosses_below" if "below" in part else default_condition
+        if "macd" in part:
+            return {"indicator": "MACD", "condition": direction}
+        sma = re.search(r"(\d+)\s*sma", part)
+        if sma:
+            return {"indicator": "Price", "condition": direction, "moving_average": {"period": int(sma.group(1))}}
+        ema = re.search(r"(\d+)\s*ema", part)
+        return {"indicator": f"EMA{ema.group(1) if ema else 20}", "condition": direction}
+
+    buy = side(buy_text, "crosses_above")
+    sell = side(sell_text, "crosses_below")
+    # "sell when crosses below" reuses the buy indicator
+    if sell.get("indicator") == "EMA20" and buy.get("indicator") != "RSI" and "ema" not in sell_text:
+        sell = {**buy, "condition": "crosses_below"}
+
+    return {"valid": True, "error": None, "suggestions": [], "rules": {"buy": buy, "sell": sell}}
+
+
+def make_handler(malformed_first: bool):
+    class Handler(BaseHTTPRequestHandler):
+        calls = 0   # generateContent requests answered (read by tests)
+        lock = threading.Lock()
+
+        def do_POST(self):
+            if not self.path.split("?")[0].endswith(":generateContent"):
+                self.send_error(404)
+                return
+
+            with Handler.lock:
+                Handler.calls += 1
+
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            contents = payload.get("contents", [])
+            # A repair turn lists the strategies to answer again, so read the latest user turn
+            prompt = contents[-1]["parts"][0]["text"] if contents else ""
+            schema = payload.get("generationConfig", {}).get("responseSchema", {})
+
+            if malformed_first and len(contents) == 1:
+                answer = '{"valid": true, "rules": {"buy": {"indicator": "RSI", "condition": "<"}'
+            elif "results" in schema.get("properties", {}):
+                lines = re.findall(r"^(\d+)\. (.*)$", prompt, re.MULTILINE)
+                answer = json.dumps({"results": [{"index": int(i), **interpret(s)} for i, s in lines]})
+            else:
+                answer = json.dumps(interpret(contents[0]["parts"][0]["text"].removeprefix("Strategy: ")))
+
+            body = json.dumps({"candidates": [{"content": {"role": "model", "parts": [{"text": answer}]}}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            print("mock-gemini:", fmt % args)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Gemini generateContent server")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--malformed-first", action="store_true", help="Break the first answer of each conversation")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args.malformed_first))
+    print(f"Mock Gemini listening on http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.services import binance_service
+from app.services.binance_service import BinanceClient, BinanceRateLimited
+from scripts.mock_binance import MockState, make_handler
+
+
+def test_concurrent_identical_requests_coalesce(serve):
+    state = MockState(ban_after=0, ban_seconds=0, delay=0.3)
+    client = BinanceClient(serve(make_handler(state)))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: client.get_klines("BTCUSDT", "1h", 50), range(8)))
+
+    assert state.requests == 1
+    assert all(r is results[0] for r in results)
+    assert len(results[0]) == 50
+
+
+def test_ban_serves_stale_cache(serve, monkeypatch):
+    monkeypatch.setattr(binance_service, "FRESH_TTL_SECONDS", 0)
+    state = MockState(ban_after=1, ban_seconds=30)
+    client = BinanceClient(serve(make_handler(state)))
+
+    first = client.get_klines("BTCUSDT", "1h", 50)
+    # Second call goes upstream, gets 418 and falls back to the cached candles
+    assert client.get_klines("BTCUSDT", "1h", 50) == first
+    # While banned, no further upstream calls are made
+    assert client.get_klines("BTCUSDT", "1h", 50) == first
+
+    assert state.requests == 2
+    assert client.banned_until > 0
+
+
+def test_ban_without_cache_raises(serve):
+    state = MockState(ban_after=1, ban_seconds=30)
+    client = BinanceClient(serve(make_handler(state)))
+
+    client.get_klines("BTCUSDT", "1h", 50)
+
+    with pytest.raises(BinanceRateLimited) as exc:
+        client.get_klines("ETHUSDT", "1h", 50)
+    assert exc.value.retry_after > 0
+
+    # Banned now: uncached keys fail fast without hitting the server
+    with pytest.raises(BinanceRateLimited):
+        client.get_klines("SOLUSDT", "1h", 50)
+    assert state.requests == 2
+
+
+def test_long_history_is_paged(serve):
+    state = MockState(ban_after=0, ban_seconds=0)
+    client = BinanceClient(serve(make_handler(state)))
+
+    candles = client.get_klines("BTCUSDT", "1h", 2500)
+
+    assert state.requests == 3
+    timestamps = [c["timestamp"] for c in candles]
+    assert timestamps == sorted(set(timestamps))
+    assert all(b - a == 3_600_000 for a, b in zip(timestamps, timestamps[1:]))
@@ -0,0 +1,96 @@
+import pytest
+
+from app.services import gemini_service
+from app.services.gemini_service import (
+    RuleCondition,
+    validate_strategies_with_gemini,
+    validate_strategy_with_gemini,
+)
+from scripts.mock_gemini import make_handler
+
+RSI = "buy when RSI < 30, sell when RSI > 70"
+MACD = "buy when MACD crosses above, sell when MACD crosses below"
+EMA = "buy when price crosses above the 50 EMA, sell when it crosses below"
+
+
+@pytest.fixture
+def gemini(serve, monkeypatch):
+    """Point the service at an in-process mock; returns a starter giving the handler (for .calls)."""
+    gemini_service.result_cache.clear()
+
+    def start(malformed_first: bool = False):
+        handler = make_handler(malformed_first)
+        monkeypatch.setattr(gemini_service, "GEMINI_URL", serve(handler) + "/v1beta/models/mock:generateContent")
+        return handler
+
+    yield start
+    gemini_service.result_cache.clear()
+
+
+def test_malformed_answer_is_repaired_once(gemini):
+    mock = gemini(malformed_first=True)
+
+    response = validate_strategy_with_gemini(RSI)
+
+    assert mock.calls == 2
+    assert response["valid"] is True
+    assert response["rules"]["buy"] == {"indicator": "RSI", "condition": "<", "value": 30.0}
+
+
+def test_repeated_strategy_hits_cache(gemini):
+    mock = gemini()
+
+    first = validate_strategy_with_gemini(RSI)
+    second = validate_strategy_with_gemini("  Buy when RSI < 30,   sell when RSI > 70 ")
+
+    assert mock.calls == 1
+    assert second == first
+    # Callers mutate the rules, so the cache hands out copies
+    assert second is not first
+
+
+def test_batch_validates_all_in_one_call(gemini):
+    mock = gemini()
+
+    responses = validate_strategies_with_gemini([RSI, MACD, "buy when moon"])
+
+    assert mock.calls == 1
+    assert [r["valid"] for r in responses] == [True, True, False]
+    assert responses[1]["rules"]["sell"]["indicator"] == "MACD"
+
+    # Now cached: no further calls, even for single lookups
+    assert validate_strategy_with_gemini(MACD) == responses[1]
+    assert mock.calls == 1
+
+
+def test_malformed_batch_gets_one_shared_repair(gemini):
+    mock = gemini(malformed_first=True)
+
+    responses = validate_strategies_with_gemini([RSI, MACD, EMA])
+
+    assert mock.calls == 2
+    assert all(r["valid"] for r in responses)
+    assert responses[2]["rules"]["buy"]["indicator"] == "EMA50"
+
+
+def test_unrepairable_batch_item_falls_back_without_second_repair(gemini):
+    mock = gemini()
+    odd_sma = "buy when price crosses above the 33 SMA, sell when price crosses below the 33 SMA"
+
+    responses = validate_strategies_with_gemini([RSI, odd_sma])
+
+    # batch + batch repair + one single-strategy call for the item still wrong
+    assert mock.calls == 3
+    assert responses[0]["valid"] is True
+    assert responses[1] is None
+
+
+def test_problems_reject_rules_the_engine_cannot_run():
+    sma = RuleCondition(indicator="Price", condition="crosses_above", moving_average={"period": 33})
+    assert sma.problems("buy") == ["buy.moving_average.period must be one of [10, 20, 50, 100, 200]"]
+
+    rsi = RuleCondition(indicator="RSI", condition="<", value=30, compare_to="EMA50")
+    assert rsi.problems("buy") == ["buy.compare_to is only supported when indicator is an EMA"]
+
+    ema = RuleCondition(indicator="ema20", condition="crosses_above", compare_to="ema50")
+    assert ema.problems("buy") == []
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("pandas_ta")
+
+from app.core.config import STARTING_EQUITY  # noqa: E402
+from app.services.portfolio_engine import simulate_portfolio  # noqa: E402
+
+# (time x assets); asset 0 exits and signals a buy on the same bar (t=3)
+CLOSE = np.array([
+    [10.0, 20.0],
+    [10.0, 20.0],
+    [11.0, 21.0],
+    [12.0, 19.0],
+    [12.0, 18.0],
+    [13.0, 22.0],
+])
+BUY = np.array([
+    [False, False],
+    [True, True],
+    [False, False],
+    [True, True],
+    [True, False],
+    [False, False],
+])
+SELL = np.array([
+    [False, False],
+    [False, False],
+    [False, False],
+    [True, False],
+    [False, False],
+    [True, True],
+])
+
+
+def trades(sim):
+    return list(zip(sim["trade_asset"].tolist(), sim["trade_entry"].tolist(), sim["trade_exit"].tolist()))
+
+
+def test_asset_cannot_reenter_on_its_exit_bar():
+    sim = simulate_portfolio(CLOSE, BUY, SELL, max_positions=2)
+
+    # Asset 0 exits at t=3 and only re-enters on the next buy (t=4)
+    assert trades(sim) == [(0, 1, 3), (0, 4, 5), (1, 1, 5)]
+
+
+def test_max_positions_limits_open_slots():
+    sim = simulate_portfolio(CLOSE, BUY, SELL, max_positions=1)
+
+    # Asset 0 wins the only slot at t=1 (earlier in the request); asset 1 gets
+    # it when asset 0 exits at t=3; asset 0's buy at t=4 finds no free slot
+    assert trades(sim) == [(0, 1, 3), (1, 3, 5)]
+    assert sim["trade_pl_usd"][0] == pytest.approx(STARTING_EQUITY * (12 / 10 - 1))
+
+
+@pytest.mark.parametrize("rebalance_every", [None, 2, 7])
+def test_trade_pl_adds_up_to_equity_change(rebalance_every):
+    rng = np.random.default_rng(7)
+    close = 100 * np.cumprod(1 + rng.normal(0, 0.02, (400, 3)), axis=0)
+    buy = rng.random((400, 3)) < 0.05
+    sell = rng.random((400, 3)) < 0.05
+    # End flat so every position is a closed trade
+    buy[-1] = False
+    sell[-1] = True
+
+    sim = simulate_portfolio(close, buy, sell, max_positions=2, rebalance_every=rebalance_every)
+
+    change = sim["equity_curve"][-1] - STARTING_EQUITY
+    assert len(sim["trade_pl_usd"]) > 10
+    assert sim["trade_pl_usd"].sum() == pytest.approx(change)
+    assert sim["realized"].sum() == pytest.approx(change)
+    assert np.allclose(sim["unrealized"], 0)
@@ -0,0 +1,43 @@
+import pytest
+
+from app.core.config import MAX_SIMULATED_TRADES, STARTING_EQUITY
+from app.services.robustness import monte_carlo
+
+RETURNS = [0.05, -0.02, 0.1, -0.07, 0.03, 0.01, -0.04]
+
+
+def test_same_seed_gives_same_report():
+    first = monte_carlo(RETURNS, simulations=2_000, seed=42)
+    second = monte_carlo(RETURNS, simulations=2_000, seed=42)
+
+    assert first == second
+    assert monte_carlo(RETURNS, simulations=2_000, seed=43) != first
+
+
+def test_shuffle_keeps_final_equity_constant():
+    report = monte_carlo(RETURNS, simulations=1_000, method="shuffle", seed=1)
+
+    expected = STARTING_EQUITY
+    for r in RETURNS:
+        expected *= 1 + r
+    final = report["final_equity"]
+    assert final["low"] == final["high"] == pytest.approx(expected, abs=1e-5)
+    # Only the order changes, so the path (drawdown) still varies
+    assert report["max_drawdown"]["low"] < report["max_drawdown"]["high"]
+
+
+@pytest.mark.parametrize("bad", [-1.0, -1.5])
+def test_total_loss_or_worse_is_rejected(bad):
+    with pytest.raises(ValueError, match="greater than -1"):
+        monte_carlo([0.1, bad], simulations=100)
+
+
+def test_oversized_request_is_rejected():
+    trades = MAX_SIMULATED_TRADES // 100 + 1
+    with pytest.raises(ValueError, match="simulations x trades"):
+        monte_carlo([0.01] * trades, simulations=100)
+
+
+def test_unknown_method_is_rejected():
+    with pytest.raises(ValueError, match="Unknown method"):
+        monte_carlo(RETURNS, simulations=100, method="jackknife")
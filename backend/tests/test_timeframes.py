@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.timeframes import (
+    align_higher_timeframe,
+    check_history,
+    resample_candles,
+    warmup_bars,
+)
+
+
+def hourly(start: str, bars: int) -> pd.DataFrame:
+    """1h candles whose close is the bar index."""
+    index = np.arange(bars, dtype=float)
+    return pd.DataFrame({
+        "timestamp": pd.date_range(start, periods=bars, freq="h"),
+        "open": index,
+        "high": index + 0.5,
+        "low": index - 0.5,
+        "close": index,
+        "volume": 1.0,
+    })
+
+
+def test_daily_close_is_known_only_after_the_day_closes():
+    base = hourly("2024-01-01", 72)
+    daily = resample_candles(base, "1h", "1d")
+    merged = align_higher_timeframe(base, daily, "1h", "1d").set_index("timestamp")
+
+    # Bars up to 22:00 close before midnight: the first day isn't finished yet
+    assert merged.loc[:"2024-01-01 22:00", "close_1d"].isna().all()
+    # The 23:00 bar closes at midnight, together with the day
+    assert merged.loc["2024-01-01 23:00", "close_1d"] == 23
+    assert (merged.loc["2024-01-02 00:00":"2024-01-02 22:00", "close_1d"] == 23).all()
+    assert merged.loc["2024-01-02 23:00", "close_1d"] == 47
+
+
+def test_incomplete_buckets_are_dropped():
+    # Starts mid-day and ends mid-day: only 2024-01-02 and 2024-01-03 are complete
+    base = hourly("2024-01-01 05:00", 19 + 48 + 10)
+    daily = resample_candles(base, "1h", "1d")
+
+    assert daily["timestamp"].tolist() == [pd.Timestamp("2024-01-02"), pd.Timestamp("2024-01-03")]
+    first = daily.iloc[0]
+    assert (first["open"], first["high"], first["low"], first["close"]) == (19, 42.5, 18.5, 42)
+    assert first["volume"] == 24
+
+
+def test_warmup_must_fit_the_history_cap():
+    assert warmup_bars("1h", {"1h"}) == 0
+    assert warmup_bars("1h", {"4h", "1d"}) == 202 * 24
+
+    check_history("1h", "90d", {"1d"})
+    with pytest.raises(ValueError, match="1d indicators on a 5m base"):
+        check_history("5m", "30d", {"1d"})